@@ -0,0 +1,61 @@
+from snapshot_tools.client_provider import get_client
+
+
+def cf_client():
+    # CloudFront client of the calling thread, with metrics and the shared rate limiter
+    return get_client('cloudfront')
+
+
+def cloudfront_distributions():
+    # Yield distribution IDs page by page, so work can start before the listing is complete
+    paginator = cf_client().get_paginator('list_distributions')
+    for page in paginator.paginate():
+        for distribution in page['DistributionList'].get('Items', []):
+            yield distribution['Id']
+
+
+def cloudfront_distribution_info(distribution_id):
+    # Fetch the current distribution configuration
+    dist_config_response = cf_client().get_distribution_config(Id=distribution_id)
+    config = dist_config_response['DistributionConfig']
+    etag = dist_config_response['ETag']
+
+    return config,etag
+
+
+def https_policy_changes(config):
+    # Bring a distribution config in line with the HTTPS policies in place, returning the fields that changed
+    changes = []
+
+    def change(field, settings, key, value):
+        if settings[key] != value:
+            changes.append({'Field': field, 'From': settings[key], 'To': value})
+            settings[key] = value
+
+    # Default behavior redirects HTTP to HTTPS
+    change('DefaultCacheBehavior.ViewerProtocolPolicy', config['DefaultCacheBehavior'], 'ViewerProtocolPolicy', 'redirect-to-https')
+    # And so do the other cache behaviors
+    for behavior in config.get('CacheBehaviors', {}).get('Items', []):
+        change(f"CacheBehaviors[{behavior['PathPattern']}].ViewerProtocolPolicy", behavior, 'ViewerProtocolPolicy', 'redirect-to-https')
+    # Ensure encryption in transit to custom origins
+    for origin in config['Origins']['Items']:
+        if 'CustomOriginConfig' in origin and origin['CustomOriginConfig']['OriginProtocolPolicy'] != 'https-only':
+            change(f"Origins[{origin['Id']}].CustomOriginConfig.OriginProtocolPolicy", origin['CustomOriginConfig'],
+                   'OriginProtocolPolicy', 'match-viewer')
+    return changes
+
+
+def deployment_statuses(distribution_ids):
+    # Status of the given distributions from one list_distributions sweep, instead of a call per distribution;
+    # the sweep stops at the page where the last of them was found
+    remaining = set(distribution_ids)
+    statuses = {}
+    paginator = cf_client().get_paginator('list_distributions')
+    for page in paginator.paginate():
+        for distribution in page['DistributionList'].get('Items', []):
+            if distribution['Id'] in remaining:
+                statuses[distribution['Id']] = distribution['Status']
+                remaining.discard(distribution['Id'])
+        if not remaining:
+            break
+    return statuses
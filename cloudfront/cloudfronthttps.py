@@ -1,31 +1,28 @@
 #!/usr/bin/env python3
 
-import boto3 
+# Uses the snapshot_tools package in rds/, install the repository first with `pip install .`
+
+import json
 import pprint
 import argparse
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+from snapshot_tools.client_provider import EXECUTOR_WORKERS
+from cloudfront_tools import cf_client, cloudfront_distribution_info, cloudfront_distributions, deployment_statuses, https_policy_changes
+from snapshot_tools.metrics import write_metrics
 
-# Create CloudFront client
-cf_client = boto3.client('cloudfront')
-
+# Distributions fetched and updated at the same time in batch mode
+DEFAULT_WORKERS = min(EXECUTOR_WORKERS, 8)
+# Seconds between two deployment status sweeps, and how long to wait for all updates to deploy
+DEPLOY_POLL_INTERVAL = 30
+DEPLOY_TIMEOUT = 1800
 
-def cloudfront_distributions_list():
-    # Fetch the list of distributions
-    distributions = cf_client.list_distributions()
-    distribution_id_list = []
-    # Extract and print the distribution IDs
-    for distribution in distributions['DistributionList']['Items']: 
-        distribution_id_list.append(distribution['Id'])
 
-    return distribution_id_list
+class PlanOutdated(Exception):
+    """The distribution changed after the plan was made, so the plan must be made again."""
 
-def cloudfront_distribution_info(distribution_id):
-    # Fetch the current distribution configuration
-    dist_config_response = cf_client.get_distribution_config(Id=distribution_id)
-    config = dist_config_response['DistributionConfig']
-    etag = dist_config_response['ETag']
-
-    return config,etag
 
 def cloudfront_distribution_info_verbose(distribution_id):
     config,etag = cloudfront_distribution_info(distribution_id)
@@ -36,71 +33,191 @@ def cloudfront_distribution_info_verbose(distribution_id):
     print(f"and viewer protocol policy:")
     pprint.pprint(f"{default_behavior_viewer_protocol_policy}")
 
-def change_distribution_policies(distribution_id):
+def plan_distribution(distribution_id):
+    # Changes the HTTPS policies need on one distribution, an empty list if it already complies,
+    # or the error if its configuration could not be read
+    try:
+        config,etag = cloudfront_distribution_info(distribution_id)
+    except ClientError as e:
+        return {'Id': distribution_id, 'Error': str(e)}
+    return {'Id': distribution_id, 'ETag': etag, 'Changes': https_policy_changes(config)}
+
+def change_distribution_policies(distribution_id, planned_changes=None):
     # Get the info about the distro
     config,etag = cloudfront_distribution_info(distribution_id)
-    # Update default behavior to use HTTPS only
-    default_behavior = config['DefaultCacheBehavior']
-    default_behavior['ViewerProtocolPolicy'] = 'redirect-to-https'
-    # If you have more cache behaviors, iterate and update them
-    if 'CacheBehaviors' in config and 'Items' in config['CacheBehaviors']:
-        for behavior in config['CacheBehaviors']['Items']:
-            behavior['ViewerProtocolPolicy'] = 'redirect-to-https'
-    # Update origin settings for encryption in transit
-    for origin in config['Origins']['Items']:
-        if 'CustomOriginConfig' in origin:
-            # Ensure encryption in transit to custom origins
-            if origin['CustomOriginConfig']['OriginProtocolPolicy'] != 'https-only':
-                origin['CustomOriginConfig']['OriginProtocolPolicy'] = 'match-viewer'
-    
- 
+    changes = https_policy_changes(config)
+    if not changes:
+        # Every update redeploys the distribution to all edge locations, even without changes
+        print(f"Distribution {distribution_id} already redirects HTTP to HTTPS, nothing to update")
+        return False
+    if planned_changes is not None and changes != planned_changes:
+        raise PlanOutdated(distribution_id)
+
     # Update the distribution with the modified configuration
-    cf_client.update_distribution(
+    cf_client().update_distribution(
         Id=distribution_id,
         DistributionConfig=config,
         IfMatch=etag  # This ensures you're updating the version of the config you just fetched
     )
     
     print(f"Updated distribution to redirect HTTP to HTTPS for viewers")
-
-
-
-
-def main(update_policy,verbose):
-
-    distribution_id_list = cloudfront_distributions_list()
-    print(distribution_id_list)
-    for distribution_id in distribution_id_list:
-        print(f"Distribution: {distribution_id}")
-
+    return True
+
+
+def run_pool(task, distribution_ids, workers):
+    # Stream the IDs into a bounded pool, so only a few pages of IDs are held at a time,
+    # and yield each result as it completes
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for distribution_id in distribution_ids:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+            in_flight.add(executor.submit(task, distribution_id))
+        yield from (future.result() for future in wait(in_flight).done)
+
+
+def process_distribution(distribution_id, change_policy, verbose, planned_changes=None):
+    # Batch mode worker: update one distribution and report the outcome instead of raising,
+    # as a message and the ID if an update was submitted
+    try:
         if verbose:
             cloudfront_distribution_info_verbose(distribution_id)
-        if update_policy is None:
-            user_input = input("Do you want to update the ViewerProtocolPolicy to 'redirect-to-https'? (yes/no): ").strip().lower()
-            #update_policy = user_input in ('yes', 'y')
-            change_policy = user_input in ('yes', 'y')
-        else:
-            change_policy = update_policy
-    
-        if change_policy:
-            change_distribution_policies(distribution_id)
-            print("Update complete.")
-        else:
-            print("No updates made.")
-
-    
-    return 0  # Success
+        if not change_policy:
+            return f"Distribution {distribution_id}: no updates made.", None
+        if change_distribution_policies(distribution_id, planned_changes):
+            return f"Distribution {distribution_id}: update submitted.", distribution_id
+        return f"Distribution {distribution_id}: already compliant, skipped.", None
+    except PlanOutdated:
+        return f"ERROR: Distribution {distribution_id} changed since the plan was made, plan again.", None
+    except ClientError as e:
+        return f"ERROR: Distribution {distribution_id} could not be updated: {e}", None
+
+
+def report(results, updated):
+    failures = 0
+    for message, updated_id in results:
+        print(message)
+        failures += message.startswith("ERROR")
+        if updated_id:
+            updated.append(updated_id)
+    return failures
+
+
+def run_batch(update_policy, verbose, workers, updated):
+    return report(run_pool(lambda distribution_id: process_distribution(distribution_id, update_policy, verbose),
+                           cloudfront_distributions(), workers), updated)
+
+
+def run_plan(plan_path, workers):
+    # Write the changes of every distribution that needs any as JSON, compliant ones are left out;
+    # distributions that could not be read are listed under Errors, returns how many there were
+    plans = []
+    errors = []
+    checked = 0
+    for plan in run_pool(plan_distribution, cloudfront_distributions(), workers):
+        checked += 1
+        if 'Error' in plan:
+            print(f"ERROR: Distribution {plan['Id']} could not be planned: {plan['Error']}")
+            errors.append(plan)
+        elif plan['Changes']:
+            print(f"Distribution {plan['Id']}: {len(plan['Changes'])} changes")
+            plans.append(plan)
+    plans.sort(key=lambda plan: plan['Id'])
+    errors.sort(key=lambda plan: plan['Id'])
+    with open(plan_path, 'w') as plan_file:
+        json.dump({'Distributions': plans, 'Errors': errors}, plan_file, indent=2)
+    print(f"{len(plans)} of {checked} distributions need changes, {len(errors)} could not be planned, plan written to {plan_path}")
+    return len(errors)
+
+
+def run_apply(plan_path, verbose, workers, updated):
+    # Push only the planned changes, skipping distributions that changed since the plan was made
+    with open(plan_path) as plan_file:
+        plans = {plan['Id']: plan['Changes'] for plan in json.load(plan_file)['Distributions']}
+    return report(run_pool(lambda distribution_id: process_distribution(distribution_id, True, verbose, plans[distribution_id]),
+                           plans, workers), updated)
+
+
+def wait_for_deployments(distribution_ids, timeout=DEPLOY_TIMEOUT, interval=DEPLOY_POLL_INTERVAL):
+    # Follow every updated distribution until it is Deployed or the deadline passes, returns True if all deployed
+    deadline = time.monotonic() + timeout
+    in_progress = set(distribution_ids)
+    deployed = 0
+    while True:
+        statuses = deployment_statuses(in_progress)
+        for distribution_id in in_progress - statuses.keys():
+            print(f"Distribution {distribution_id} is no longer listed, not waiting for it")
+        deployed += sum(1 for status in statuses.values() if status == 'Deployed')
+        in_progress = {distribution_id for distribution_id, status in statuses.items() if status != 'Deployed'}
+        remaining = deadline - time.monotonic()
+        print(f"Deployments: {len(in_progress)} InProgress, {deployed} Deployed of {len(distribution_ids)}, {max(0, remaining):.0f}s left")
+        if not in_progress:
+            return True
+        if remaining <= 0:
+            print(f"ERROR: Still deploying after {timeout}s: {', '.join(sorted(in_progress))}")
+            return False
+        time.sleep(min(interval, remaining))
+
+
+def main(update_policy,verbose,batch=False,workers=DEFAULT_WORKERS,plan=None,apply=None,wait_deployed=False,deploy_timeout=DEPLOY_TIMEOUT):
+
+    if plan:
+        failures = run_plan(plan, workers)
+        write_metrics()
+        return 1 if failures else 0
+
+    updated = []
+    if apply:
+        failures = run_apply(apply, verbose, workers, updated)
+    elif batch:
+        failures = run_batch(update_policy, verbose, workers, updated)
+    else:
+        failures = 0
+        for distribution_id in cloudfront_distributions():
+            print(f"Distribution: {distribution_id}")
+
+            if verbose:
+                cloudfront_distribution_info_verbose(distribution_id)
+            if update_policy is None:
+                user_input = input("Do you want to update the ViewerProtocolPolicy to 'redirect-to-https'? (yes/no): ").strip().lower()
+                #update_policy = user_input in ('yes', 'y')
+                change_policy = user_input in ('yes', 'y')
+            else:
+                change_policy = update_policy
+        
+            if change_policy:
+                if change_distribution_policies(distribution_id):
+                    updated.append(distribution_id)
+                    print("Update submitted.")
+            else:
+                print("No updates made.")
+
+    # Updates only take effect once CloudFront reports the distributions as Deployed
+    if wait_deployed and updated and not wait_for_deployments(updated, deploy_timeout):
+        failures += 1
+
+    write_metrics()
+    return 1 if failures else 0
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Tool to manage CloudFront distributions.")
     parser.add_argument('--update-policy', type=str, choices=['yes', 'no'], help="Update the ViewerProtocolPolicy to 'redirect-to-https' (yes/no).")
     parser.add_argument('-v', '--verbose', action='store_true', help="Increase output verbosity.")
+    parser.add_argument('--batch', action='store_true', help="Process distributions concurrently without prompting; needs --update-policy.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Distributions processed at the same time in batch mode.")
+    parser.add_argument('--plan', metavar='PLAN_FILE', help="Write the changes each distribution needs as JSON, without updating anything.")
+    parser.add_argument('--apply', metavar='PLAN_FILE', help="Apply the changes of a plan written by --plan.")
+    parser.add_argument('--wait', action='store_true', help="Wait until every updated distribution is Deployed.")
+    parser.add_argument('--deploy-timeout', type=int, default=DEPLOY_TIMEOUT, help="Seconds to wait for the deployments with --wait.")
     
     args = parser.parse_args()
+    if args.batch and args.update_policy is None:
+        parser.error("--batch needs --update-policy yes or no")
 
     # Convert the --update-policy to a boolean if provided, else None
     update_policy = None
     if args.update_policy:
         update_policy = args.update_policy == 'yes'
 
-    sys.exit(main(update_policy,args.verbose))
+    sys.exit(main(update_policy,args.verbose,args.batch,args.workers,args.plan,args.apply,args.wait,args.deploy_timeout))
@@ -0,0 +1,54 @@
+import argparse
+import statistics
+import sys
+import time
+import boto3
+from snapshot_tools.client_provider import create_executor, get_client
+
+
+def describe_with_new_client(region_name, profile_name):
+    # What the status checks used to do: a fresh session and client per call
+    rds_client = boto3.Session(profile_name=profile_name, region_name=region_name).client('rds')
+    rds_client.describe_db_snapshots(SnapshotType='manual', MaxRecords=20)
+
+
+def describe_with_cached_client(region_name, profile_name):
+    # Without the rate limiter, which would time its queue instead of the client reuse
+    rds_client = get_client('rds', region_name, profile_name, rate_limit=None)
+    rds_client.describe_db_snapshots(SnapshotType='manual', MaxRecords=20)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def run(function, calls, region_name, profile_name):
+    executor = create_executor()
+    futures = [executor.submit(timed, function, region_name, profile_name) for _ in range(calls)]
+    latencies = sorted(future.result() for future in futures)
+    executor.shutdown()
+    return latencies
+
+
+def report(name, latencies):
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name}: calls {len(latencies)}, mean {statistics.mean(latencies) * 1000:.1f} ms, "
+          f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+
+
+def main(calls, region_name, profile_name):
+    report('new client per call', run(describe_with_new_client, calls, region_name, profile_name))
+    report('cached pooled client', run(describe_with_cached_client, calls, region_name, profile_name))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-call latency of fresh and cached RDS clients.")
+    parser.add_argument('--calls', type=int, default=200, help='Number of describe_db_snapshots calls per run.')
+    parser.add_argument('--region', help='The AWS region to use.')
+    parser.add_argument('--profile', help='The AWS profile to use.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.calls, args.region, args.profile))
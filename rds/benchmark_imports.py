@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RDS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter: time the import and record what it connects to and writes
+PROBE = '''
+import json, sys, time
+connects, writes = [], []
+
+def audit(event, args):
+    if event == 'socket.connect':
+        connects.append(repr(args[1]))
+    elif event == 'open' and isinstance(args[1], str) and any(flag in args[1] for flag in 'wax+'):
+        writes.append(str(args[0]))
+    elif event == 'sqlite3.connect':
+        writes.append(str(args[0]))
+
+sys.addaudithook(audit)
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'connects': connects, 'writes': writes}}))
+'''
+
+DEFAULT_TARGETS = {
+    'package': 'import snapshot_tools',
+    'package-listing': 'from snapshot_tools import create_backend, stream_unencrypted_snapshots',
+    'encrypt-script': 'import importlib; importlib.import_module("encrypt_rds_snapshots_async")',
+    'sqlite-script': 'import importlib; importlib.import_module("encrypt_rds_snapshots_async_sqlite")',
+    'delete-script': 'import importlib; importlib.import_module("delete_rds_snapshots_async")',
+}
+
+
+def measure(statement, workdir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [RDS_DIR, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', PROBE.format(statement=statement)], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main(targets, runs):
+    failures = 0
+    for name in targets:
+        # A new working directory per target, so any file an import leaves behind shows up
+        with tempfile.TemporaryDirectory() as workdir:
+            samples = [measure(DEFAULT_TARGETS[name], workdir) for _ in range(runs)]
+            left_behind = os.listdir(workdir)
+        connects = sorted({address for sample in samples for address in sample['connects']})
+        writes = sorted({path for sample in samples for path in sample['writes']} | set(left_behind))
+        elapsed = [sample['elapsed'] for sample in samples]
+        print(f"{name}: median {statistics.median(elapsed) * 1000:.1f} ms, min {min(elapsed) * 1000:.1f} ms over {runs} runs, "
+              f"{len(connects)} connections, {len(writes)} files written")
+        for address in connects:
+            print(f"  ERROR: connects to {address} on import")
+        for path in writes:
+            print(f"  ERROR: writes {path} on import")
+        failures += bool(connects or writes)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the snapshot_tools package and the scripts, and check that importing them has no side effects.")
+    parser.add_argument('--target', nargs='+', choices=sorted(DEFAULT_TARGETS), default=list(DEFAULT_TARGETS), help='Imports to measure.')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per import.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.target, args.runs))
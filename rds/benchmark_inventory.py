@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from inventory import REPORTS
+from snapshot_tools.inventory_table import FORMATS, INVENTORY_SOURCES, InventoryBuilder, InventoryTable, np, pq
+from snapshot_tools.stub_backend import StubBackend
+
+ACCOUNTS = ('111111111111', '222222222222', '333333333333')
+REGIONS = ('us-east-1', 'us-west-2', 'eu-west-1')
+
+
+def build(row_count):
+    # Synthetic DB snapshots spread over a few accounts and regions, a third of them encrypted
+    builder = InventoryBuilder()
+    source = INVENTORY_SOURCES[0]
+    for number, snapshot in enumerate(StubBackend(row_count).snapshots.values()):
+        snapshot['Encrypted'] = number % 3 == 0
+        builder.add(ACCOUNTS[number % len(ACCOUNTS)], REGIONS[number // len(ACCOUNTS) % len(REGIONS)], source, snapshot)
+    return builder.table()
+
+
+def main(row_count, repeat):
+    start = time.perf_counter()
+    table = build(row_count)
+    print(f"Built {len(table)} rows in {time.perf_counter() - start:.2f}s")
+    formats = [extension for extension, file_format in FORMATS.items() if file_format != 'parquet' or pq is not None]
+    with tempfile.TemporaryDirectory() as workdir:
+        for extension in formats:
+            path = os.path.join(workdir, f'inventory{extension}')
+            start = time.perf_counter()
+            table.save(path)
+            saved = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = InventoryTable.load(path)
+            load = time.perf_counter() - start
+            print(f"{extension}: {os.path.getsize(path) / 2 ** 20:.2f} MB, saved in {saved * 1000:.0f} ms, loaded in {load * 1000:.0f} ms")
+            mask = np.ones(len(loaded), dtype=bool)
+            for name, report in REPORTS.items():
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    report(loaded, mask, time.time())
+                    samples.append(time.perf_counter() - start)
+                print(f"  {name}: best {min(samples) * 1000:.2f} ms over {repeat} runs")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the size, load time and report times of the columnar inventory.")
+    parser.add_argument('--rows', type=int, default=500000, help='Synthetic snapshots in the inventory.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each report.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.rows, args.repeat))
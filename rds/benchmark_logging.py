@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from snapshot_tools import log_setup
+from benchmark_snapshot_pipelines import monitor_loop_lag
+from snapshot_tools.stub_backend import StubBackend
+
+PAGE_SIZE = 100
+
+
+def setup_sync_logging(log_file, stream):
+    # What the scripts used to attach: console and file handlers writing on the calling thread
+    logger = logging.getLogger(log_setup.LOGGER_NAME)
+    logger.setLevel(logging.DEBUG)
+    for handler in (logging.StreamHandler(stream), logging.FileHandler(log_file)):
+        handler.setFormatter(logging.Formatter(log_setup.TEXT_FORMAT))
+        logger.addHandler(handler)
+    return logger
+
+
+def debug_eager(logger, snapshot):
+    logger.debug(f"DBSnapshotIdentifier: {snapshot['DBSnapshotIdentifier']}, Status: {snapshot['Status']}, DBInstanceIdentifier: {snapshot['DBInstanceIdentifier']}, SnapshotType: {snapshot['SnapshotType']}, Engine: {snapshot['Engine']}, SnapshotCreateTime: {snapshot['SnapshotCreateTime']} , Encrypted: {snapshot['Encrypted']}")
+
+
+async def list_snapshots(snapshots, logger, debug):
+    # The listing loop of the scripts, with a page boundary every PAGE_SIZE snapshots
+    for number, snapshot in enumerate(snapshots):
+        if number % PAGE_SIZE == 0:
+            await asyncio.sleep(0)
+        if snapshot['Encrypted'] == False:
+            debug(logger, snapshot)
+            yield snapshot['DBSnapshotIdentifier']
+
+
+async def measure(snapshots, logger, debug):
+    lag_samples = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples, interval=0.001))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    count = len([snapshot_id async for snapshot_id in list_snapshots(snapshots, logger, debug)])
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    lag_samples.sort()
+    return count, elapsed, lag_samples
+
+
+def run(name, snapshots, workdir, devnull):
+    logger = logging.getLogger(log_setup.LOGGER_NAME)
+    logger.handlers.clear()
+    log_file = os.path.join(workdir, f'{name}.log')
+    if name == 'sync-eager':
+        logger = setup_sync_logging(log_file, devnull)
+        debug = debug_eager
+    else:
+        _, level, log_format = name.split('-')
+        logger = log_setup.setup_logging(log_file, level.upper(), log_format, devnull)
+        debug = log_setup.debug_snapshot
+    count, elapsed, lag_samples = asyncio.run(measure(snapshots, logger, debug))
+    # Time the writer thread still needs for the queued records
+    start = time.perf_counter()
+    log_setup.stop_logging()
+    drain = time.perf_counter() - start
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers.clear()
+    p99 = lag_samples[int(len(lag_samples) * 0.99) - 1] if lag_samples else 0.0
+    print(f"{name}: {count} snapshots in {elapsed:.3f}s ({elapsed / count * 1e6:.1f} us each), "
+          f"writer drain {drain:.3f}s, loop lag p99 {p99 * 1000:.2f} ms, max {lag_samples[-1] * 1000 if lag_samples else 0:.2f} ms")
+
+
+def main(snapshot_count, setups):
+    snapshots = list(StubBackend(snapshot_count).snapshots.values())
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull:
+        for name in setups:
+            run(name, snapshots, workdir, devnull)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-snapshot logging overhead of the listing loop.")
+    parser.add_argument('--snapshots', type=int, default=100000, help='Synthetic snapshots to list.')
+    parser.add_argument('--setup', nargs='+', default=['sync-eager', 'queue-debug-text', 'queue-debug-json', 'queue-info-text'],
+                        help="Logging setups: 'sync-eager' or 'queue-<level>-<text|json>'.")
+    args = parser.parse_args()
+
+    sys.exit(main(args.snapshots, args.setup))
@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import sys
+import tracemalloc
+from snapshot_tools.delete_planner import snapshot_inventory
+from snapshot_tools.snapshot_kinds import DB_SNAPSHOT
+from snapshot_tools.snapshot_stream import stream_snapshots
+from snapshot_tools.stub_backend import StubBackend
+
+
+async def inventory_of_dicts(backend):
+    # What snapshot_inventory used to keep: every describe response item
+    return {snapshot['DBSnapshotIdentifier']: snapshot async for snapshot in stream_snapshots(backend, DB_SNAPSHOT, SnapshotType='manual')}
+
+
+async def inventory_of_records(backend):
+    return (await snapshot_inventory(backend, [DB_SNAPSHOT]))[DB_SNAPSHOT]
+
+
+def measure(build, snapshot_count):
+    backend = StubBackend(snapshot_count, latency=0)
+    # The stub hands out copies of its snapshots, so only what the listing keeps is traced
+    tracemalloc.start()
+    inventory = asyncio.run(build(backend))
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(inventory), held, peak
+
+
+def main(snapshot_count):
+    for name, build in (('dicts', inventory_of_dicts), ('records', inventory_of_records)):
+        count, held, peak = measure(build, snapshot_count)
+        print(f"{name}: {count} snapshots, {held / 2 ** 20:.1f} MB held ({held / count:.0f} bytes each), peak {peak / 2 ** 20:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory a snapshot listing keeps as response dicts and as SnapshotRef records.")
+    parser.add_argument('--snapshots', type=int, default=100000, help='Synthetic snapshots to list.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.snapshots))
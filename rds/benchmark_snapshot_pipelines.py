@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import functools
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from snapshot_tools.copy_policies import SCHEDULING_POLICIES, create_policy
+from snapshot_tools.copy_scheduler import CopyScheduler
+from snapshot_tools.job_store import SnapshotJobStore
+from snapshot_tools.poll_schedule import AdaptivePollSchedule
+from snapshot_tools.snapshot_cache import SnapshotInventoryCache
+from snapshot_tools.snapshot_events import LocalEventQueue, snapshot_events
+from snapshot_tools.snapshot_poller import SnapshotStatusPoller
+from snapshot_tools.stub_backend import StubBackend
+
+SCENARIOS = ('list', 'encrypt', 'sqlite')
+RESULTS_PATH = 'benchmark_results.jsonl'
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def import_script(name):
+    # Importing a script has no side effects, its stores are replaced before they are first used
+    logging.getLogger('my_app').setLevel(logging.WARNING)
+    return importlib.import_module(name)
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    # How late the event loop wakes up a task that sleeps for interval
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def poll_schedule(backend, args):
+    # With events the stub reports every finished copy, polling only reconciles
+    if backend.events is not None:
+        return AdaptivePollSchedule(args.reconcile_interval, args.reconcile_interval, first_check_delay=args.reconcile_interval)
+    return AdaptivePollSchedule(args.min_poll, args.max_poll)
+
+
+async def run_list(workdir, backend, args):
+    module = import_script('encrypt_rds_snapshots_async')
+    module.snapshot_cache = SnapshotInventoryCache(os.path.join(workdir, 'list-cache.db'), ttl=0)
+    return len([snapshot_id async for snapshot_id in module.list_rds_db_snapshots(backend)])
+
+
+async def run_encrypt(workdir, backend, args):
+    module = import_script('encrypt_rds_snapshots_async')
+    module.snapshot_cache = SnapshotInventoryCache(os.path.join(workdir, 'encrypt-cache.db'), ttl=0)
+    key_id = await module.get_or_create_kms_key(backend, 'aws/rds')
+    poller = SnapshotStatusPoller(backend, poll_schedule(backend, args), tick_interval=args.min_poll)
+    scheduler = CopyScheduler(
+        lambda snapshot: module.create_encrypted_copy(backend, snapshot, key_id),
+        lambda snapshot, encrypted_snapshot_id: module.delete_unencrypted_snapshot(snapshot, encrypted_snapshot_id, poller),
+        max_in_flight=args.max_in_flight,
+        policy=create_policy(args.policy)
+    )
+    async with snapshot_events(backend.events, poller.notify):
+        await scheduler.run(module.list_unencrypted_snapshots(backend))
+    return scheduler.completed
+
+
+async def run_sqlite(workdir, backend, args):
+    module = import_script('encrypt_rds_snapshots_async_sqlite')
+    module.store = SnapshotJobStore(os.path.join(workdir, 'sqlite-jobs.db'))
+    module.snapshot_cache = SnapshotInventoryCache(os.path.join(workdir, 'sqlite-cache.db'), ttl=0)
+    # Scale the script's poll intervals down to the stub's copy durations
+    module.MIN_POLL_INTERVAL = args.min_poll
+    module.AdaptivePollSchedule = functools.partial(AdaptivePollSchedule, args.min_poll, args.max_poll)
+    module.reconcile_schedule = lambda events: poll_schedule(backend, args)
+    key_id = await module.get_or_create_kms_key(backend, 'aws/rds')
+    scheduler = CopyScheduler(
+        lambda snapshot_id: module.encrypt_snapshot(backend, snapshot_id, key_id),
+        module.wait_for_original_deleted,
+        max_in_flight=args.max_in_flight
+    )
+    copies = asyncio.create_task(scheduler.run(module.store_pending_snapshots(backend)))
+    await module.check_and_delete_snapshot(backend, copies, backend.events)
+    await copies
+    module.store.close()
+    return scheduler.completed
+
+
+async def run_scenario(scenario, snapshot_count, args):
+    backend = StubBackend(snapshot_count, args.latency, args.page_size, args.throttle_rate, args.copy_duration,
+                          service_rate=args.service_rate, copy_seconds_per_gib=args.copy_seconds_per_gib,
+                          events=LocalEventQueue() if args.events else None)
+    runner = {'list': run_list, 'encrypt': run_encrypt, 'sqlite': run_sqlite}[scenario]
+    lag_samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+        tracemalloc.start()
+        started = time.monotonic()
+        start = time.perf_counter()
+        processed = await runner(workdir, backend, args)
+        elapsed = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        monitor.cancel()
+    lag_samples.sort()
+    api_calls = sum(backend.calls.values())
+    deletions = [(deleted_at - started, storage) for deleted_at, storage in backend.deletions]
+    return {
+        'scenario': scenario,
+        'snapshots': snapshot_count,
+        'processed': processed,
+        'seconds': round(elapsed, 3),
+        'snapshots_per_second': round(processed / elapsed, 1) if elapsed else None,
+        'api_calls': api_calls,
+        'api_calls_per_snapshot': round(api_calls / snapshot_count, 3) if snapshot_count else None,
+        'calls_by_operation': dict(backend.calls),
+        'throttled_calls': sum(backend.throttles.values()),
+        'mean_deletion_seconds': round(sum(elapsed for elapsed, _ in deletions) / len(deletions), 3) if deletions else None,
+        'half_deleted_seconds': _time_to_half(deletions, lambda storage: 1),
+        'half_storage_reclaimed_seconds': _time_to_half(deletions, lambda storage: storage),
+        'peak_memory_mb': round(peak_memory / 2 ** 20, 2),
+        'loop_lag_p99_ms': round(lag_samples[int(len(lag_samples) * 0.99) - 1] * 1000, 2) if lag_samples else None,
+        'loop_lag_max_ms': round(lag_samples[-1] * 1000, 2) if lag_samples else None,
+    }
+
+
+def _time_to_half(deletions, weight):
+    # Seconds until half of the total weight of the deleted snapshots was deleted
+    total = sum(weight(storage) for _, storage in deletions)
+    reached = 0
+    for elapsed, storage in deletions:
+        reached += weight(storage)
+        if reached * 2 >= total:
+            return round(elapsed, 3)
+    return None
+
+
+def previous_result(results_path, result):
+    # Latest stored result of the same scenario and settings from another revision
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as results_file:
+        for line in results_file:
+            stored = json.loads(line)
+            if (stored['revision'] != result['revision'] and stored['scenario'] == result['scenario']
+                    and stored['snapshots'] == result['snapshots'] and stored['settings'] == result['settings']):
+                previous = stored
+    return previous
+
+
+def main(args):
+    settings = {
+        'latency': args.latency, 'page_size': args.page_size, 'throttle_rate': args.throttle_rate,
+        'copy_duration': args.copy_duration, 'service_rate': args.service_rate,
+        'copy_seconds_per_gib': args.copy_seconds_per_gib, 'policy': args.policy, 'max_in_flight': args.max_in_flight,
+        'min_poll': args.min_poll, 'max_poll': args.max_poll,
+        'events': args.events, 'reconcile_interval': args.reconcile_interval,
+    }
+    revision = git_revision()
+    for scenario in args.scenario:
+        for snapshot_count in args.snapshots:
+            result = asyncio.run(run_scenario(scenario, snapshot_count, args))
+            result.update(revision=revision, settings=settings, recorded_at=time.time())
+            print(f"{scenario} x {snapshot_count}: {result['seconds']}s, {result['snapshots_per_second']} snapshots/s, "
+                  f"{result['api_calls_per_snapshot']} calls/snapshot, {result['throttled_calls']} throttled, "
+                  f"peak {result['peak_memory_mb']} MB, loop lag p99 {result['loop_lag_p99_ms']} ms")
+            if result['mean_deletion_seconds'] is not None:
+                print(f"    deletions: mean {result['mean_deletion_seconds']}s, half of the snapshots after {result['half_deleted_seconds']}s, "
+                      f"half of the storage after {result['half_storage_reclaimed_seconds']}s")
+            previous = previous_result(args.results, result)
+            if previous:
+                print(f"    previous {previous['revision']}: {previous['seconds']}s, {previous['snapshots_per_second']} snapshots/s, "
+                      f"{previous['api_calls_per_snapshot']} calls/snapshot, peak {previous['peak_memory_mb']} MB")
+            with open(args.results, 'a') as results_file:
+                results_file.write(json.dumps(result) + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the RDS snapshot pipelines against an in-memory RDS/KMS stand-in.")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='Pipelines to run.')
+    parser.add_argument('--snapshots', nargs='+', type=int, default=[100, 1000, 10000], help='Synthetic snapshot counts.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds per API attempt.')
+    parser.add_argument('--page-size', type=int, default=100, help='Records per describe page.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Probability that an API attempt is throttled.')
+    parser.add_argument('--service-rate', type=float, help='Requests per second per API family before the stub throttles.')
+    parser.add_argument('--copy-duration', type=float, default=1.0, help='Seconds an encrypted copy takes.')
+    parser.add_argument('--copy-seconds-per-gib', type=float, default=0.0, help='Extra copy seconds per GiB of allocated storage.')
+    parser.add_argument('--policy', choices=SCHEDULING_POLICIES, default='fifo', help='Copy scheduling policy of the encrypt scenario.')
+    parser.add_argument('--max-in-flight', type=int, default=500, help='Copies in flight at the same time.')
+    parser.add_argument('--min-poll', type=float, default=0.1, help='Shortest delay between status checks.')
+    parser.add_argument('--max-poll', type=float, default=2.0, help='Longest delay between status checks.')
+    parser.add_argument('--events', action='store_true', help='Report finished copies through a local RDS event queue.')
+    parser.add_argument('--reconcile-interval', type=float, default=10.0, help='Delay between status checks with --events.')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file the results are appended to.')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -1,216 +1,18 @@
+import argparse
 import asyncio
-import boto3
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from botocore.exceptions import ClientError
-
-client = boto3.client('rds')
-executor = ThreadPoolExecutor()
-
-
-# Create logger
-logger = logging.getLogger('my_app')
-logger.setLevel(logging.DEBUG)
-
-# Create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# Create file handler and set level to debug
-fh = logging.FileHandler('delete.log')
-fh.setLevel(logging.DEBUG)
-
-# Add formatter to the handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(ch)
-logger.addHandler(fh)
-
-# Log messages
-logger.debug('This is a debug message')
-logger.info('This is an info message')
-
-
-
-
-
-
-
-
-
-
-
-
-
-def check_rds_db_snapshot_status(rds_db_snapshot_identifier):
-    rds_client = boto3.client('rds')
-
-    status_response = ''
-    try:
-        logger.debug(f"rds_db_snapshot_identifier {rds_db_snapshot_identifier}")
-        response = rds_client.describe_db_snapshots(
-            DBSnapshotIdentifier=rds_db_snapshot_identifier
-        )
-        for info in response['DBSnapshots']:
-            status_response = info['Status']
-            logger.info(f"{rds_db_snapshot_identifier} is in state {status_response}")
-            # status_dictionary[rds_db_snapshot_identifier] = status_response
-        return status_response
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {rds_db_snapshot_identifier} could not be found for inspection.")
-        else:
-            logger.info(f"ERROR: For {rds_db_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def check_rds_cluster_snapshot_status(rds_cluster_snapshot_identifier):
-    rds_client = boto3.client('rds')
-
-    status_response = ''
-    try:
-        logger.debug(f"rds_cluster_snapshot_identifier {rds_cluster_snapshot_identifier}")
-        response = rds_client.describe_db_cluster_snapshots(
-            DBSnapshotIdentifier=rds_cluster_snapshot_identifier
-        )
-        for info in response['DBSnapshots']:
-            status_response = info['Status']
-            logger.info(f"{rds_cluster_snapshot_identifier} is in state {status_response}")
-            # status_dictionary[rds_db_snapshot_identifier] = status_response
-        return status_response
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'DBClusterSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB Cluster snapshot {rds_cluster_snapshot_identifier} could not be found for inspection.")
-        else:
-            logger.info(f"ERROR: For {rds_cluster_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def delete_rds_db_snapshot(db_snapshot_identifier):
-
-    rds_client = boto3.client('rds')
-    
-    try:
-        response = rds_client.delete_db_snapshot(
-            DBSnapshotIdentifier=db_snapshot_identifier
-        )
-        logger.info(f"Deleting DB snapshot: {response['DBSnapshot']['DBSnapshotIdentifier']}")
-    
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'InvalidDBSnapshotStateFault':
-            logger.info(f"ERROR: The DB snapshot {db_snapshot_identifier}is not in a valid state for deletion.")
-        elif error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {db_snapshot_identifier} could not be found for deletion.")
-        else:
-            logger.info(f"ERROR: For {db_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def delete_rds_cluster_snapshot(cluster_snapshot_identifier):
-
-    rds_client = boto3.client('rds')
-    
-    try:
-        response = rds_client.delete_db_cluster_snapshot(
-            DBClusterSnapshotIdentifier=cluster_snapshot_identifier
-        )
-        logger.info(f"Deleting DB cluster snapshot: {response['DBClusterSnapshot']['DBClusterSnapshotIdentifier']}")
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'InvalidDBClusterSnapshotStateFault':
-            logger.info(f"ERROR: The DB cluster snapshot {cluster_snapshot_identifier} is not in a valid state for deletion.")
-        elif error_code == 'DBClusterSnapshotNotFoundFault':
-            logger.info(f"ERROR: The specified DB cluster snapshot {cluster_snapshot_identifier} could not be found for deletion.")
-        else:
-            logger.info(f"ERROR: For {cluster_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def delete_rds_cluster_snapshot(cluster_snapshot_identifier):
-
-    rds_client = boto3.client('rds')
-    
-    try:
-        response = rds_client.delete_db_cluster_snapshot(
-            DBClusterSnapshotIdentifier=cluster_snapshot_identifier
-        )
-        logger.info(f"Deleting DB cluster snapshot: {response['DBClusterSnapshot']['DBClusterSnapshotIdentifier']}")
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'InvalidDBClusterSnapshotStateFault':
-            logger.info(f"ERROR: The DB cluster snapshot {cluster_snapshot_identifier} is not in a valid state for deletion.")
-        elif error_code == 'DBClusterSnapshotNotFoundFault':
-            logger.info(f"ERROR: The specified DB cluster snapshot {cluster_snapshot_identifier} could not be found for deletion.")
-        else:
-            logger.info(f"ERROR: For {cluster_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-
-
-
-async def delete_unencrypted_db_snapshot(snapshot_id, encrypted_snapshot_id):
-    loop = asyncio.get_running_loop()
-    
-    while True:
-        # Check status of encrypted snapshot
-        logger.info(f"Checking status of encrypted snapshot {encrypted_snapshot_id}")
-        response = await loop.run_in_executor(
-            executor,
-            check_rds_db_snapshot_status,
-            encrypted_snapshot_id
-            # client.describe_db_snapshots,
-            # DBSnapshotIdentifier=encrypted_snapshot_id
-        )
-        # status = response['DBSnapshots'][0]['Status']
-        status = response
-        if status == 'available':
-            logger.info(f"Deleting unencrypted db snapshot {snapshot_id}")
-            # Delete unencrypted snapshot
-            await loop.run_in_executor(
-                executor,
-                delete_rds_db_snapshot,
-                snapshot_id
-                # client.delete_db_snapshot,
-                # DBSnapshotIdentifier=snapshot_id
-            )
-            break
-        await asyncio.sleep(60)  # Wait for 60 seconds before checking again
-
-
-async def delete_unencrypted_cluster_snapshot(snapshot_id, encrypted_snapshot_id):
-    loop = asyncio.get_running_loop()
-    
-    while True:
-        # Check status of encrypted snapshot
-        logger.info(f"Checking status of encrypted snapshot {encrypted_snapshot_id}")
-        response = await loop.run_in_executor(
-            executor,
-            check_rds_cluster_snapshot_status,
-            encrypted_snapshot_id
-            # client.describe_db_snapshots,
-            # DBSnapshotIdentifier=encrypted_snapshot_id
-        )
-        # status = response['DBSnapshots'][0]['Status']
-        status = response
-        if status == 'available':
-            logger.info(f"Deleting unencrypted cluster db snapshot {snapshot_id}")
-            # Delete unencrypted snapshot
-            await loop.run_in_executor(
-                executor,
-                delete_rds_cluster_snapshot,
-                snapshot_id
-                # client.delete_db_snapshot,
-                # DBSnapshotIdentifier=snapshot_id
-            )
-            break
-        await asyncio.sleep(60)  # Wait for 60 seconds before checking again
-
-
-async def main():
-
-    encrypted_snapshots = ['emr-pre-vpc-move-encrypted',
+import sys
+from snapshot_tools.backends import create_backend
+from snapshot_tools.delete_planner import DELETE_CONCURRENCY, build_delete_plan, execute_delete_plan
+from snapshot_tools.log_setup import LOGGER_NAME, setup_logging
+from snapshot_tools.metrics import metrics_dumping
+from snapshot_tools.snapshot_events import create_event_queue, reconcile_schedule, snapshot_events
+from snapshot_tools.snapshot_poller import SnapshotStatusPoller
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Encrypted snapshots whose unencrypted originals are deleted when no input is given
+ENCRYPTED_SNAPSHOTS = ['emr-pre-vpc-move-encrypted',
 'emr-production-eu-west-1-final-snapshot-encrypted',
 'emr-production-eu-west-1-mreddy-encrypted',
 'emr-rds-adhoc-production2-encrypted',
@@ -228,28 +30,42 @@ async def main():
 'post-alienvault-alert-encrypted']
 
 
-    
-    tasks = []
-    # for snapshot in unencrypted_rds_db_snapshots:
-    for snapshot in encrypted_snapshots:
-        # snapshot_id = snapshot
-        # encrypted_snapshot_id = await create_encrypted_db_copy(snapshot_id)
-        print(snapshot)
-        snapshot_id = snapshot.removesuffix('-encrypted')
-        encrypted_snapshot_id =  snapshot
-        tasks.append(delete_unencrypted_db_snapshot(snapshot_id, encrypted_snapshot_id))
-
-    # for snapshot in unencrypted_rds_cluster_snapshots:
-    #     snapshot_id = snapshot
-    #     encrypted_snapshot_id = await create_encrypted_cluster_copy(snapshot_id)
-    #     tasks.append(delete_unencrypted_cluster_snapshot(snapshot_id, encrypted_snapshot_id))
-        
-
-    await asyncio.gather(*tasks)
-
-asyncio.run(main())
-
-
-
-
-
+async def main(lines, dry_run=False, concurrency=DELETE_CONCURRENCY):
+    async with create_backend() as backend, metrics_dumping():
+        # One inventory sweep tells which pairs can go now, which wait for their copy and which stay
+        plan = await build_delete_plan(backend, lines)
+        logger.info(f"Delete plan: {plan.summary()}")
+        for pair, reason in plan.keep:
+            logger.info(f"Keeping {pair.original}: {reason}")
+        if dry_run:
+            for pair in plan.delete:
+                logger.info(f"Would delete {pair.original}")
+            for pair in plan.wait:
+                logger.info(f"Would delete {pair.original} once {pair.encrypted_identifier} is available")
+            return 0
+
+        events = create_event_queue(backend)
+        poller = SnapshotStatusPoller(backend, reconcile_schedule(events))
+        async with snapshot_events(events, poller.notify):
+            deleted = await execute_delete_plan(backend, plan, poller, concurrency)
+        logger.info(f"Deleted {deleted} of {len(plan.delete) + len(plan.wait)} planned snapshots")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete unencrypted RDS snapshots whose encrypted copies are available.")
+    parser.add_argument('input', nargs='?', help="File with one encrypted snapshot ID, 'original encrypted' pair or glob per line "
+                                                 "('cluster:' prefix for cluster snapshots), '-' for stdin.")
+    parser.add_argument('--dry-run', action='store_true', help="Only log the delete plan.")
+    parser.add_argument('--concurrency', type=int, default=DELETE_CONCURRENCY, help="Deletes running at the same time.")
+    args = parser.parse_args()
+
+    # Log through a background writer thread, level and format come from the environment
+    setup_logging('delete.log')
+    if args.input == '-':
+        lines = sys.stdin
+    elif args.input:
+        with open(args.input) as input_file:
+            lines = input_file.readlines()
+    else:
+        lines = ENCRYPTED_SNAPSHOTS
+    sys.exit(asyncio.run(main(lines, args.dry_run, args.concurrency)))
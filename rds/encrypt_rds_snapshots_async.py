@@ -1,212 +1,99 @@
 import asyncio
-import boto3
 import logging
+import os
 import re
-from concurrent.futures import ThreadPoolExecutor
-from botocore.exceptions import ClientError
-
-rds_client = boto3.client('rds')
-executor = ThreadPoolExecutor()
-
-# Create logger
-logger = logging.getLogger('my_app')
-logger.setLevel(logging.DEBUG)
-
-# Create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# Create file handler and set level to debug
-fh = logging.FileHandler('async.log')
-fh.setLevel(logging.DEBUG)
-
-# Add formatter to the handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(ch)
-logger.addHandler(fh)
-
-# Log messages
-logger.debug('This is a debug message')
-logger.info('This is an info message')
-
-def get_or_create_kms_key(alias_name):
-    # Initialize the KMS client
-    kms_client = boto3.client('kms')
-    # Check if the key alias already exists
-    try:
-        response = kms_client.describe_key(KeyId=f'alias/{alias_name}')
-        key_id = response['KeyMetadata']['KeyId']
-        logger.info(f"KMS key with alias '{alias_name}' already exists with KeyId: {key_id}")
-        return key_id
-    except kms_client.exceptions.NotFoundException:
-        # If the key alias does not exist, create a new key
-        key_description = 'Default master key that protects my RDS database volumes when no other key is defined'
-        key_response = kms_client.create_key(
-            Description=key_description,
-            Origin='AWS_KMS',  # AWS managed key
-            KeyUsage='ENCRYPT_DECRYPT',
-            BypassPolicyLockoutSafetyCheck=False
-        )
-        key_id = key_response['KeyMetadata']['KeyId']
-        # Create an alias for the new key
-        kms_client.create_alias(
-            AliasName=f'alias/{alias_name}',
-            TargetKeyId=key_id
-        )
-        logger.info(f"Created new KMS key with alias '{alias_name}' and KeyId: {key_id}")
-        return key_id
-
-
-def list_rds_db_snapshots():
-
-    db_snapshots_list = []
-    # Paginator for RDS DB snapshots
-    db_snapshot_paginator = rds_client.get_paginator('describe_db_snapshots')
-    # Iterate through pages of DB snapshots
-    for page in db_snapshot_paginator.paginate(SnapshotType='manual'):
-        for snapshot in page['DBSnapshots']:
-            if snapshot['Encrypted'] == False:
-                logger.debug(f"DBSnapshotIdentifier: {snapshot['DBSnapshotIdentifier']}, Status: {snapshot['Status']}, DBInstanceIdentifier: {snapshot['DBInstanceIdentifier']}, SnapshotType: {snapshot['SnapshotType']}, Engine: {snapshot['Engine']}, SnapshotCreateTime: {snapshot['SnapshotCreateTime']} , Encrypted: {snapshot['Encrypted']}")
-               # db_snapshots_list.append(snapshot['DBSnapshotIdentifier'])
-                db_snapshot_identifier = snapshot['DBSnapshotIdentifier']
-                match = re.search(r'[^:]+$' , db_snapshot_identifier)
-                if match:
-                    db_snapshot_identifier = match.group(0)
-                    db_snapshots_list.append(db_snapshot_identifier)
-    return db_snapshots_list
-
-
-# def encrypt_rds_db_snapshot(source_db_snapshot_identifier,kms_key_id):
-def encrypt_rds_db_snapshot(source_db_snapshot_identifier,key_id):
-    kms_key_id=key_id
-
-    suffix = 'encrypted'
-    # Specify target  RDS DB encrypted snapshot name
-    target_encrypted_db_snapshot_identifier = f"{source_db_snapshot_identifier}-{suffix}"
-    try:
-        # Create a copy of the DB snapshot with encryption enabled
-        response = rds_client.copy_db_snapshot(
-            SourceDBSnapshotIdentifier=source_db_snapshot_identifier,
-            TargetDBSnapshotIdentifier=target_encrypted_db_snapshot_identifier,
-            KmsKeyId=kms_key_id
-        )
-        logger.info(f"Encrypted DB snapshot created: {response['DBSnapshot']['DBSnapshotIdentifier']}")
-        encrypted_db_snapshot_id = response['DBSnapshot']['DBSnapshotIdentifier']
-        return encrypted_db_snapshot_id
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'DBSnapshotAlreadyExists':
-            logger.info(f"ERROR: The DB snapshot {target_encrypted_db_snapshot_identifier} for encryption already exists.")
-            return target_encrypted_db_snapshot_identifier
-        elif error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {source_db_snapshot_identifier} for encryption could not be found.")
-        elif error_code == 'InvalidDBSnapshotState':
-            logger.info(f"ERROR: The specified DB snapshot {source_db_snapshot_identifier} for encryption is in invalid state.")
-        elif error_code == 'SnapshotQuotaExceeded':
-            logger.info(f"ERROR: Snapshot Quota has been Exceeded.")
-        elif error_code == 'KMSKeyNotAccessible':
-            logger.info(f"ERROR: KMS Key {kms_key_id} Not Accessible.")
-        elif error_code == 'CustomAvailabilityZoneNotFound':
-            logger.info(f"ERROR: Custom Availability Zone Not Found.")
-        else:
-            logger.info(f"ERROR: For {source_db_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def check_rds_db_snapshot_status(rds_db_snapshot_identifier):
-
-    status_response = ''
-    try:
-        logger.debug(f"rds_db_snapshot_identifier {rds_db_snapshot_identifier}")
-        response = rds_client.describe_db_snapshots(
-            DBSnapshotIdentifier=rds_db_snapshot_identifier
-        )
-        for info in response['DBSnapshots']:
-            status_response = info['Status']
-            logger.info(f"{rds_db_snapshot_identifier} is in state {status_response}")
-            logger.debug(type(status_response))
-        return status_response
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {rds_db_snapshot_identifier} could not be found for inspection.")
-        else:
-            logger.info(f"ERROR: For {rds_db_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-def delete_rds_db_snapshot(db_snapshot_identifier):
-
-    try:
-        response = rds_client.delete_db_snapshot(
-            DBSnapshotIdentifier=db_snapshot_identifier
-        )
-        logger.info(f"Deleting DB snapshot: {response['DBSnapshot']['DBSnapshotIdentifier']}")
-    
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'InvalidDBSnapshotStateFault':
-            logger.info(f"ERROR: The DB snapshot {db_snapshot_identifier}is not in a valid state for deletion.")
-        elif error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {db_snapshot_identifier} could not be found for deletion.")
-        else:
-            logger.info(f"ERROR: For {db_snapshot_identifier} an unexpected error occurred: {e}")
-
-
-async def create_encrypted_db_copy(snapshot_id,key_id):
-    loop = asyncio.get_running_loop()
-    encrypted_snapshot_id = f"{snapshot_id}-encrypted".replace(':', '-') 
-    
-    # Start copy operation
-    logger.info(f"Start encryption for snapshot_id {snapshot_id}")
-    await loop.run_in_executor(
-        executor,
-        encrypt_rds_db_snapshot,
-        snapshot_id,
-        key_id
-    )
+from snapshot_tools.backends import create_backend
+from snapshot_tools.client_provider import create_executor
+from snapshot_tools.kms_keys import KmsKeyCache, get_or_create_kms_key
+from snapshot_tools.log_setup import LOGGER_NAME, debug_snapshot, setup_logging
+from snapshot_tools.copy_scheduler import CopyScheduler, get_manual_snapshot_quota
+from snapshot_tools.metrics import metrics_dumping
+from snapshot_tools.region_pipeline import CrossRegionPipeline
+from snapshot_tools.snapshot_cache import SnapshotInventoryCache, copy_record
+from snapshot_tools.snapshot_events import create_event_queue, reconcile_schedule, snapshot_events
+from snapshot_tools.snapshot_engine import copy_encrypted_snapshot, delete_when_encrypted, merge_streams, stream_unencrypted_snapshots
+from snapshot_tools.snapshot_kinds import CLUSTER_SNAPSHOT, DB_SNAPSHOT
+from snapshot_tools.snapshot_poller import SnapshotStatusPoller
+
+# Opened on first use
+snapshot_cache = SnapshotInventoryCache()
+# Region the encrypted copies are also copied to, for disaster recovery
+DR_REGION = os.environ.get('SNAPSHOT_DR_REGION')
+
+logger = logging.getLogger(LOGGER_NAME)
+
+async def list_rds_db_snapshots(backend):
+    # Stream manual DB snapshots page by page, or from the local inventory cache while it is fresh
+    async for snapshot in snapshot_cache.iter_db_snapshots(backend):
+        if snapshot['Encrypted'] == False:
+            debug_snapshot(logger, snapshot)
+            db_snapshot_identifier = snapshot['DBSnapshotIdentifier']
+            match = re.search(r'[^:]+$' , db_snapshot_identifier)
+            if match:
+                db_snapshot_identifier = match.group(0)
+                yield DB_SNAPSHOT.ref(snapshot, db_snapshot_identifier)
+
+
+def list_unencrypted_snapshots(backend):
+    # DB snapshots and Aurora cluster snapshots interleaved; the cluster snapshots are reported as failed,
+    # as RDS cannot encrypt them by copying
+    return merge_streams(list_rds_db_snapshots(backend), stream_unencrypted_snapshots(backend, CLUSTER_SNAPSHOT))
+
+
+async def create_encrypted_copy(backend, snapshot, key_id):
+    # Start copy operation, the result is None if the copy could not be started
+    logger.debug("Start encryption for %s", snapshot)
+    encrypted_snapshot_id = await copy_encrypted_snapshot(backend, snapshot, key_id)
+    if encrypted_snapshot_id is not None and snapshot.kind is DB_SNAPSHOT:
+        await snapshot_cache.upsert(backend, copy_record(encrypted_snapshot_id))
     return encrypted_snapshot_id
 
 
-async def delete_unencrypted_db_snapshot(snapshot_id, encrypted_snapshot_id):
-    loop = asyncio.get_running_loop()
-    
-    while True:
-        # Check status of encrypted snapshot
-        logger.info(f"Checking status of encrypted snapshot {encrypted_snapshot_id}")
-        response = await loop.run_in_executor(
-            executor,
-            check_rds_db_snapshot_status,
-            encrypted_snapshot_id
-        )
-        status = response
-        if status == 'available':
-            logger.info(f"Deleting unencrypted db snapshot {snapshot_id}")
-            # Delete unencrypted snapshot
-            await loop.run_in_executor(
-                executor,
-                delete_rds_db_snapshot,
-                snapshot_id
-            )
-            break
-        await asyncio.sleep(60)  # Wait for 60 seconds before checking again
+async def delete_unencrypted_snapshot(snapshot, encrypted_snapshot_id, poller, on_available=None):
+    # Wait for the shared poller to report the encrypted copy as finished, then delete the original
+    deleted = await delete_when_encrypted(snapshot, encrypted_snapshot_id, poller, on_available)
+    if deleted and snapshot.kind is DB_SNAPSHOT:
+        await snapshot_cache.mark_deleted(poller.backend, snapshot.identifier)
+    return deleted
 
 
 async def main():
-    key_alias = 'aws/rds'
-    key_id = get_or_create_kms_key(key_alias)
-    logger.info(f"Use this KeyId for further operations: {key_id}")
-    # Fetch unencrypted snapshots
-    unencrypted_rds_db_snapshots = list_rds_db_snapshots()
-
-    tasks = []
-    for snapshot in unencrypted_rds_db_snapshots:
-       snapshot_id = snapshot
-       encrypted_snapshot_id = await create_encrypted_db_copy(snapshot_id,key_id)
-       tasks.append(delete_unencrypted_db_snapshot(snapshot_id, encrypted_snapshot_id))
-
-    await asyncio.gather(*tasks)
+    executor = create_executor()
+    async with create_backend(executor=executor) as backend, metrics_dumping():
+        key_alias = 'aws/rds'
+        # Key IDs are looked up once per region
+        key_cache = KmsKeyCache(get_or_create_kms_key)
+        # Stream unencrypted DB and cluster snapshots, copies start while later pages are still being listed
+        unencrypted_snapshots = list_unencrypted_snapshots(backend)
+
+        # With an RDS event queue copies are picked up when they finish, polling only reconciles
+        events = create_event_queue(backend)
+        poller = SnapshotStatusPoller(backend, reconcile_schedule(events))
+
+        if DR_REGION:
+            # Each encrypted copy moves on to the DR region as soon as it is available
+            async with create_backend(executor=executor, region_name=DR_REGION) as dr_backend:
+                pipeline = CrossRegionPipeline(backend, dr_backend, key_cache, key_alias, poller, SnapshotStatusPoller(dr_backend),
+                                               copy_encrypted=create_encrypted_copy, delete_original=delete_unencrypted_snapshot)
+                async with snapshot_events(events, poller.notify):
+                    await pipeline.run(unencrypted_snapshots)
+            return
+
+        key_id = await key_cache.key_id(backend, key_alias)
+        logger.info(f"Use this KeyId for further operations: {key_id}")
+        snapshot_quota = await get_manual_snapshot_quota(backend)
+        logger.info(f"Manual snapshots left in quota: {snapshot_quota}")
+
+        # Start the next copy as soon as one finishes and its original is deleted
+        scheduler = CopyScheduler(
+            lambda snapshot: create_encrypted_copy(backend, snapshot, key_id),
+            lambda snapshot, encrypted_snapshot_id: delete_unencrypted_snapshot(snapshot, encrypted_snapshot_id, poller),
+            snapshot_quota=snapshot_quota
+        )
+        async with snapshot_events(events, poller.notify):
+            await scheduler.run(unencrypted_snapshots)
 
-asyncio.run(main())
+if __name__ == "__main__":
+    # Log through a background writer thread, level and format come from the environment
+    setup_logging('async.log')
+    asyncio.run(main())
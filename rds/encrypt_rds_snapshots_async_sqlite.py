@@ -1,145 +1,210 @@
-import boto3
-import sqlite3
 import asyncio
 import logging
-# import re
+import time
 from botocore.exceptions import ClientError
-
-rds = boto3.client('rds')
-
-# Create logger
-logger = logging.getLogger('my_app')
-logger.setLevel(logging.DEBUG)
-
-# Create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# Create file handler and set level to debug
-fh = logging.FileHandler('async-sqlite.log')
-fh.setLevel(logging.DEBUG)
-
-# Add formatter to the handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(ch)
-logger.addHandler(fh)
-
-# Log messages
-logger.debug('This is a debug message')
-logger.info('This is an info message')
-
-# Setting up SQLite
-conn = sqlite3.connect('rds_snapshots.db')
-cursor = conn.cursor()
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS snapshots (
-        original_snapshot_id TEXT,
-        encrypted_snapshot_id TEXT,
-        status TEXT
-    )
-''')
-conn.commit()
-
-def get_or_create_kms_key(alias_name):
-    # Initialize the KMS client
-    kms_client = boto3.client('kms')
-    # Check if the key alias already exists
-    try:
-        response = kms_client.describe_key(KeyId=f'alias/{alias_name}')
-        key_id = response['KeyMetadata']['KeyId']
-        logger.info(f"KMS key with alias '{alias_name}' already exists with KeyId: {key_id}")
-        return key_id
-    except kms_client.exceptions.NotFoundException:
-        # If the key alias does not exist, create a new key
-        key_description = 'Default master key that protects my RDS database volumes when no other key is defined'
-        key_response = kms_client.create_key(
-            Description=key_description,
-            Origin='AWS_KMS',  # AWS managed key
-            KeyUsage='ENCRYPT_DECRYPT',
-            BypassPolicyLockoutSafetyCheck=False
-        )
-        key_id = key_response['KeyMetadata']['KeyId']
-        # Create an alias for the new key
-        kms_client.create_alias(
-            AliasName=f'alias/{alias_name}',
-            TargetKeyId=key_id
-        )
-        logger.info(f"Created new KMS key with alias '{alias_name}' and KeyId: {key_id}")
-        return key_id
-
-def list_rds_db_snapshots():
-
-    rds_client = boto3.client('rds')
-    db_snapshots_list = []
-    # Paginator for RDS DB snapshots
-    db_snapshot_paginator = rds_client.get_paginator('describe_db_snapshots')
-    # Iterate through pages of DB snapshots
-    for page in db_snapshot_paginator.paginate(SnapshotType='manual'):
-        for snapshot in page['DBSnapshots']:
-            if snapshot['Encrypted'] == False:
-                logger.debug(f"DBSnapshotIdentifier: {snapshot['DBSnapshotIdentifier']}, Status: {snapshot['Status']}, DBInstanceIdentifier: {snapshot['DBInstanceIdentifier']}, SnapshotType: {snapshot['SnapshotType']}, Engine: {snapshot['Engine']}, SnapshotCreateTime: {snapshot['SnapshotCreateTime']} , Encrypted: {snapshot['Encrypted']}")
-                db_snapshot_identifier = snapshot['DBSnapshotIdentifier']
-                db_snapshots_list.append(db_snapshot_identifier)
-    return db_snapshots_list
-
-async def encrypt_snapshot(snapshot_id,key_id):
+from snapshot_tools.backends import create_backend
+from snapshot_tools.copy_scheduler import CopyQuotaExceeded, CopyScheduler, get_manual_snapshot_quota
+from snapshot_tools.job_store import AVAILABLE, COPYING, DELETED, FAILED, PENDING, SnapshotJobStore
+from snapshot_tools.kms_keys import get_or_create_kms_key
+from snapshot_tools.log_setup import LOGGER_NAME, debug_snapshot, setup_logging
+from snapshot_tools.metrics import REGISTRY, metrics_dumping, snapshot_jobs
+from snapshot_tools.poll_schedule import AdaptivePollSchedule, DEFAULT_POLL_INTERVAL, MIN_POLL_INTERVAL
+from snapshot_tools.snapshot_cache import SnapshotInventoryCache, copy_record
+from snapshot_tools.snapshot_events import create_event_queue, reconcile_schedule, sleep_until_notified, snapshot_events
+from snapshot_tools.snapshot_kinds import DB_SNAPSHOT
+from snapshot_tools.snapshot_poller import MAX_NOT_FOUND_CHECKS, NOT_FOUND_STATUS, TERMINAL_SNAPSHOT_STATUSES, describe_db_snapshot_statuses
+from snapshot_tools.snapshot_stream import batched
+
+
+logger = logging.getLogger(LOGGER_NAME)
+
+# Setting up SQLite, the databases are opened on first use
+store = SnapshotJobStore('rds_snapshots.db')
+snapshot_cache = SnapshotInventoryCache()
+
+
+def collect_snapshot_jobs():
+    for status, count in store.counts().items():
+        snapshot_jobs.set(count, state=status)
+
+async def list_rds_db_snapshots(backend):
+
+    # Stream manual DB snapshots page by page, or from the local inventory cache while it is fresh
+    async for snapshot in snapshot_cache.iter_db_snapshots(backend):
+        if snapshot['Encrypted'] == False:
+            debug_snapshot(logger, snapshot)
+            db_snapshot_identifier = snapshot['DBSnapshotIdentifier']
+            yield db_snapshot_identifier
+
+async def store_pending_snapshots(backend):
+    # Record each listed page as pending jobs and pass the pending ones on to the copy stage; jobs a
+    # previous run already moved on keep their state. The listing only counts as complete once it has
+    # been read to the end, so a run that stops halfway lists again on restart.
+    store.set_listing_complete(False)
+    async for page in batched(list_rds_db_snapshots(backend)):
+        for snapshot_id in store.add_pending(page):
+            yield snapshot_id
+    store.set_listing_complete(True)
+
+async def encrypt_snapshot(backend, snapshot_id, key_id):
     encrypted_snapshot_id = snapshot_id + '-encrypted'
     # Initiate copy to create encrypted snapshot
     try:
-        rds.copy_db_snapshot(
+        await backend.call(
+            'rds', 'copy_db_snapshot',
             SourceDBSnapshotIdentifier=snapshot_id,
             TargetDBSnapshotIdentifier=encrypted_snapshot_id,
             KmsKeyId=key_id,
             CopyTags=True
         )
-        cursor.execute("INSERT INTO snapshots VALUES (?, ?, 'copying')", (snapshot_id, encrypted_snapshot_id))
-        conn.commit()
+        store.transition(snapshot_id, PENDING, COPYING, encrypted_snapshot_id)
+        await snapshot_cache.upsert(backend, copy_record(encrypted_snapshot_id))
+        return encrypted_snapshot_id
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'DBSnapshotAlreadyExists':
-            logger.info(f"ERROR: The DB snapshot {encrypted_snapshot_id} for encryption already exists.")
+            # A copy started before a restart, keep waiting for it
+            logger.info("ERROR: The DB snapshot %s for encryption already exists.", encrypted_snapshot_id)
+            store.transition(snapshot_id, PENDING, COPYING, encrypted_snapshot_id)
+            return encrypted_snapshot_id
         elif error_code == 'DBSnapshotNotFound':
-            logger.info(f"ERROR: The specified DB snapshot {snapshot_id} for encryption could not be found.")
+            logger.info("ERROR: The specified DB snapshot %s for encryption could not be found.", snapshot_id)
         elif error_code == 'InvalidDBSnapshotState':
-            logger.info(f"ERROR: The specified DB snapshot {snapshot_id} for encryption is in invalid state.")
+            logger.info("ERROR: The specified DB snapshot %s for encryption is in invalid state.", snapshot_id)
         elif error_code == 'SnapshotQuotaExceeded':
-            logger.info(f"ERROR: Snapshot Quota has been Exceeded.")
+            logger.info("ERROR: Snapshot Quota has been Exceeded, requeueing %s.", snapshot_id)
+            raise CopyQuotaExceeded(snapshot_id) from e
         elif error_code == 'KMSKeyNotAccessible':
-            logger.info(f"ERROR: KMS Key {key_id} Not Accessible.")
+            logger.info("ERROR: KMS Key %s Not Accessible.", key_id)
         elif error_code == 'CustomAvailabilityZoneNotFound':
-            logger.info(f"ERROR: Custom Availability Zone Not Found.")
+            logger.info("ERROR: Custom Availability Zone Not Found.")
         else:
-            logger.info(f"ERROR: For {snapshot_id} an unexpected error occurred: {e}")
-
-async def check_and_delete_snapshot():
-    while True:
-        await asyncio.sleep(60)  # check every minute
-        rows = cursor.execute("SELECT original_snapshot_id, encrypted_snapshot_id FROM snapshots WHERE status='copying'").fetchall()
-        for row in rows:
-            encrypted_snapshot = rds.describe_db_snapshots(DBSnapshotIdentifier=row[1])
-            if encrypted_snapshot['DBSnapshots'][0]['Status'] == 'available':
-                rds.delete_db_snapshot(DBSnapshotIdentifier=row[0])  # delete unencrypted snapshot
-                cursor.execute("UPDATE snapshots SET status='available' WHERE original_snapshot_id=?", (row[0],))
-                conn.commit()
+            logger.info("ERROR: For %s an unexpected error occurred: %s", snapshot_id, e)
+        store.transition(snapshot_id, PENDING, FAILED, error=error_code)
 
-async def main():
-    
-    key_alias = 'aws/rds'
-    key_id = get_or_create_kms_key(key_alias)
-    logger.info(f"Use this KeyId for further operations: {key_id}")
-
-    # Identify unencrypted snapshots
-    snapshots = list_rds_db_snapshots()
+async def wait_for_original_deleted(snapshot_id, encrypted_snapshot_id):
+    # check_and_delete_snapshot moves the job on once the copy is available and the original deleted
+    while store.status(snapshot_id) in (COPYING, AVAILABLE):
+        await asyncio.sleep(MIN_POLL_INTERVAL)
 
-    tasks = [encrypt_snapshot(snapshot,key_id) for snapshot in snapshots]
+async def delete_original_snapshot(backend, snapshot_id):
+    try:
+        await backend.call('rds', 'delete_db_snapshot', DBSnapshotIdentifier=snapshot_id)  # delete unencrypted snapshot
+        store.transition(snapshot_id, AVAILABLE, DELETED)
+        await snapshot_cache.mark_deleted(backend, snapshot_id)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'DBSnapshotNotFound':
+            logger.info("ERROR: The specified DB snapshot %s could not be found for deletion.", snapshot_id)
+            store.transition(snapshot_id, AVAILABLE, DELETED)
+            await snapshot_cache.mark_deleted(backend, snapshot_id)
+        else:
+            logger.info("ERROR: For %s an unexpected error occurred: %s", snapshot_id, e)
+            store.transition(snapshot_id, AVAILABLE, FAILED, error=error_code)
+
+async def check_and_delete_snapshot(backend, copies, events=None):
+    schedule = reconcile_schedule(events) if events is not None else AdaptivePollSchedule()
+    next_check = {}
+    not_found = {}
+    reported = {}
+    wakeup = asyncio.Event()
+
+    def notify(kind, encrypted_snapshot_id, status=None):
+        # An event for an encrypted copy settles or checks its job right away
+        if kind is DB_SNAPSHOT:
+            reported[encrypted_snapshot_id] = status
+            wakeup.set()
+
+    async with snapshot_events(events, notify):
+        while True:
+            # Copies that finished before a restart only still need their original deleted
+            for snapshot_id, encrypted_snapshot_id in store.jobs(AVAILABLE):
+                await delete_original_snapshot(backend, snapshot_id)
+            store.flush()
+            # Stop once the copy stage has finished and no started copy is left, or right away if it failed;
+            # jobs whose copy failed to start stay pending for the next run
+            if copies.done() and (copies.cancelled() or copies.exception() is not None
+                                  or not store.has_open_jobs((COPYING, AVAILABLE))):
+                break
+            await sleep_until_notified(wakeup, MIN_POLL_INTERVAL)
+            await check_copies(backend, schedule, next_check, not_found, reported)
+
+async def check_copies(backend, schedule, next_check, not_found, reported):
+    rows = store.jobs(COPYING)
+    # Copies an event reported as finished need no describe call, other reported ones are checked now
+    statuses = {}
+    for snapshot_id, encrypted_snapshot_id in rows:
+        if encrypted_snapshot_id in reported:
+            statuses[encrypted_snapshot_id] = reported.pop(encrypted_snapshot_id)
+    reported.clear()
+    # Otherwise only check copies whose estimated finish time has come up
+    now = time.time()
+    for snapshot_id, encrypted_snapshot_id in rows:
+        next_check.setdefault(encrypted_snapshot_id, now + schedule.first_check_delay)
+    due = {encrypted_snapshot_id for snapshot_id, encrypted_snapshot_id in rows
+           if encrypted_snapshot_id in statuses and statuses[encrypted_snapshot_id] is None
+           or encrypted_snapshot_id not in statuses and next_check[encrypted_snapshot_id] <= now}
+    # Describe all due snapshots together instead of one call per row
+    encrypted_snapshots = await describe_db_snapshot_statuses(backend, due) if due else {}
+    for snapshot_id, encrypted_snapshot_id in rows:
+        encrypted_snapshot = encrypted_snapshots.get(encrypted_snapshot_id)
+        status = statuses.get(encrypted_snapshot_id) or (encrypted_snapshot or {}).get('Status')
+        if status is None and encrypted_snapshot_id in due:
+            # Missing from the describe results, the copy fails once it stays missing
+            misses = not_found[encrypted_snapshot_id] = not_found.get(encrypted_snapshot_id, 0) + 1
+            if misses < MAX_NOT_FOUND_CHECKS:
+                next_check[encrypted_snapshot_id] = now + DEFAULT_POLL_INTERVAL
+                continue
+            status = NOT_FOUND_STATUS
+        if status in TERMINAL_SNAPSHOT_STATUSES or status == NOT_FOUND_STATUS:
+            next_check.pop(encrypted_snapshot_id, None)
+            not_found.pop(encrypted_snapshot_id, None)
+            schedule.forget(encrypted_snapshot_id)
+            if status == 'available':
+                store.transition(snapshot_id, COPYING, AVAILABLE)
+            else:
+                # failed, incompatible-* or missing: the copy will not become available
+                logger.info("ERROR: Encrypted snapshot %s is %s, keeping %s", encrypted_snapshot_id, status, snapshot_id)
+                store.transition(snapshot_id, COPYING, FAILED, error=f'copy {status}')
+        elif encrypted_snapshot is not None:
+            not_found.pop(encrypted_snapshot_id, None)
+            next_check[encrypted_snapshot_id] = now + schedule.next_delay(encrypted_snapshot, now)
 
-    # Start encryption and monitoring
-    await asyncio.gather(*tasks, check_and_delete_snapshot())
+async def main():
+    async with create_backend() as backend:
+        key_alias = 'aws/rds'
+        key_id = await get_or_create_kms_key(backend, key_alias)
+        logger.info(f"Use this KeyId for further operations: {key_id}")
+
+        # Resume the pending jobs of a complete listing while any job is open, otherwise list again:
+        # after an interrupted listing, or to pick up snapshots created since the last run
+        if store.listing_complete() and store.has_open_jobs():
+            logger.info(f"Resuming stored snapshot jobs: {store.counts()}")
+            snapshots = (snapshot_id for snapshot_id, encrypted_snapshot_id in store.iter_jobs(PENDING))
+        else:
+            snapshots = store_pending_snapshots(backend)
 
-asyncio.run(main())
+        # Keep only as many copies in flight as the quotas allow, requeueing quota errors
+        scheduler = CopyScheduler(
+            lambda snapshot_id: encrypt_snapshot(backend, snapshot_id, key_id),
+            wait_for_original_deleted,
+            snapshot_quota=await get_manual_snapshot_quota(backend)
+        )
 
+        # Start encryption and monitoring
+        flusher = asyncio.create_task(store.flush_periodically())
+        try:
+            async with metrics_dumping():
+                copies = asyncio.create_task(scheduler.run(snapshots))
+                await check_and_delete_snapshot(backend, copies, create_event_queue(backend))
+                await copies
+            logger.info(f"Snapshot jobs: {store.counts()}")
+        finally:
+            flusher.cancel()
+            store.close()
+
+if __name__ == "__main__":
+    # Log through a background writer thread, level and format come from the environment
+    setup_logging('async-sqlite.log')
+    REGISTRY.add_collector(collect_snapshot_jobs)
+    asyncio.run(main())
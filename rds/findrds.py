@@ -1,119 +1,160 @@
 import boto3
 import sys
 import argparse
-from botocore.exceptions import ProfileNotFound
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
+from snapshot_tools.metrics import register_metrics, write_metrics
+from snapshot_tools.rate_limiter import register_rate_limits
+from snapshot_tools.rds_inventory import RdsInventory
 
-# Function to setup the boto3 session
-def setup_boto3_session(profile_name):
-    try:
-        # Create a boto3 session using the specified profile
-        session = boto3.Session(profile_name=profile_name)
-        return session.client('rds')
-    except ProfileNotFound:
-        print(f"Profile '{profile_name}' not found.")
-        exit(1)
+# Scans running at the same time across all profiles and regions
+DEFAULT_WORKERS = 16
+
+# One session per profile, shared by the clients of all its regions
+sessions = {}
+
+# Function to setup the boto3 session, raises ProfileNotFound for an unknown profile
+def setup_boto3_session(profile_name, region_name=None):
+    # Create a boto3 session using the specified profile
+    session = sessions.get(profile_name)
+    if session is None:
+        session = sessions[profile_name] = boto3.Session(profile_name=profile_name)
+    return register_metrics(register_rate_limits(session.client('rds', region_name=region_name), profile_name))
 
 
 # Function to find all unencrypted RDS instances
-def find_unencrypted_rds_instances(rds_client):
-    instances = []
-    paginator = rds_client.get_paginator('describe_db_instances')
-    for page in paginator.paginate():
-        for instance in page['DBInstances']:
-            if not instance['StorageEncrypted']:
-                instances.append(instance['DBInstanceIdentifier'])
-    return instances
+def find_unencrypted_rds_instances(inventory):
+    instances = inventory.instances_where(lambda instance: not instance['StorageEncrypted'])
+    return [instance['DBInstanceIdentifier'] for instance in instances]
 
 
 # Function to find all unencrypted RDS clusters
-def find_unencrypted_rds_clusters(rds_client):
-    clusters = []
-    paginator = rds_client.get_paginator('describe_db_clusters')
-    for page in paginator.paginate():
-        for cluster in page['DBClusters']:
-            if not cluster['StorageEncrypted']:
-                clusters.append(cluster['DBClusterIdentifier'])
-    return clusters
+def find_unencrypted_rds_clusters(inventory):
+    clusters = inventory.clusters_where(lambda cluster: not cluster['StorageEncrypted'])
+    return [cluster['DBClusterIdentifier'] for cluster in clusters]
 
 
 # Function to find PostgreSQL RDS instances and their versions
-def find_postgresql_versions(rds_client):
-    postgresql_instances = []
-    paginator = rds_client.get_paginator('describe_db_instances')
-    for page in paginator.paginate():
-        for instance in page['DBInstances']:
-            # Check if the instance's engine is PostgreSQL
-            if 'postgres' in instance['Engine']:
-                instance_info = {
-                    'DBInstanceIdentifier': instance['DBInstanceIdentifier'],
-                    'EngineVersion': instance['EngineVersion']
-                }
-                postgresql_instances.append(instance_info)
-    return postgresql_instances
-
-
-
-def list_rds_instance_types(rds_client):
-    rds_instance_types = []
-    # Paginator can help if there are many instances
-    paginator = rds_client.get_paginator('describe_db_instances')
-    for page in paginator.paginate():
-        for instance in page['DBInstances']:
-            # Extract the DB instance identifier and the instance class
-            instance_info = {
-                'DBInstanceIdentifier': instance['DBInstanceIdentifier'],
-                'DBInstanceClass': instance['DBInstanceClass']
-            }
-            rds_instance_types.append(instance_info)
-    return rds_instance_types
+def find_postgresql_versions(inventory):
+    # Check if the instance's engine is PostgreSQL
+    instances = inventory.instances_where(lambda instance: 'postgres' in instance['Engine'])
+    return inventory.project(instances, 'DBInstanceIdentifier', 'EngineVersion')
+
+
+
+def list_rds_instance_types(inventory):
+    # Extract the DB instance identifier and the instance class
+    return inventory.project(inventory.instances, 'DBInstanceIdentifier', 'DBInstanceClass')
 
 #            instance_id = instance['DBInstanceIdentifier']
 #            instance_class = instance['DBInstanceClass']
 #            print(f"Instance ID: {instance_id}, Instance Class: {instance_class}")
 
 
-def main(profile):
-    # Initialize RDS client with specified AWS profile
-    rds_client = setup_boto3_session(profile)
-    
-    # Get all unencrypted RDS instances and clusters
-    unencrypted_instances = find_unencrypted_rds_instances(rds_client)
-    unencrypted_clusters = find_unencrypted_rds_clusters(rds_client)
-    
+# Reports printed by main, each one a view over the same inventory
+REPORTS = {
+    'unencrypted_instances': find_unencrypted_rds_instances,
+    'unencrypted_clusters': find_unencrypted_rds_clusters,
+    'postgresql_instances': find_postgresql_versions,
+    'rds_instance_types': list_rds_instance_types,
+}
+
+
+def scan_targets(profiles, regions, workers=DEFAULT_WORKERS):
+    # (profile, region, report, error) of every target; a target that fails to scan only reports its error
+    results = {}
+    # Clients are created up front because boto3 sessions are not thread safe
+    targets = []
+    for profile in profiles:
+        for region in regions:
+            try:
+                targets.append((profile, region, setup_boto3_session(profile, region)))
+            except (ProfileNotFound, BotoCoreError) as e:
+                results[(profile, region)] = (None, e)
+
+    # Collect instances and clusters of every profile and region once, on one bounded worker pool
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(profile, region, executor.submit(RdsInventory.collect, rds_client, profile, region))
+                   for profile, region, rds_client in targets]
+        for profile, region, future in futures:
+            try:
+                inventory = future.result()
+            except (ClientError, BotoCoreError) as e:
+                results[(profile, region)] = (None, e)
+            else:
+                results[(profile, region)] = ({name: report(inventory) for name, report in REPORTS.items()}, None)
+    return [(profile, region, *results[(profile, region)]) for profile in profiles for region in regions]
+
+
+def combined_totals(reports):
+    # Totals over the reports of every target that was scanned
+    return {
+        'unencrypted_instances': sum(len(report['unencrypted_instances']) for report in reports),
+        'unencrypted_clusters': sum(len(report['unencrypted_clusters']) for report in reports),
+        'postgresql_versions': Counter(instance['EngineVersion'] for report in reports for instance in report['postgresql_instances']),
+        'instance_classes': Counter(instance['DBInstanceClass'] for report in reports for instance in report['rds_instance_types']),
+    }
+
+
+def print_report(report):
     # Print the results
     print("Unencrypted RDS Instances:")
-    for instance_id in unencrypted_instances:
+    for instance_id in report['unencrypted_instances']:
         print(instance_id)
     
     print("\nUnencrypted RDS Clusters:")
-    for cluster_id in unencrypted_clusters:
+    for cluster_id in report['unencrypted_clusters']:
         print(cluster_id)
     
     print("\n")
 
-    # Get all PostgreSQL RDS instances and their versions
-    postgresql_instances = find_postgresql_versions(rds_client)
-    # Print the results
-    for instance in postgresql_instances:
+    # Print all PostgreSQL RDS instances and their versions
+    for instance in report['postgresql_instances']:
         print(f"Instance ID: {instance['DBInstanceIdentifier']}, PostgreSQL Version: {instance['EngineVersion']}")
 
     print("\n")
 
-    # Get all the RDS instance types
-    rds_instance_types = list_rds_instance_types(rds_client)
-    # Print the results
-    for instance in rds_instance_types:
+    # Print all the RDS instance types
+    for instance in report['rds_instance_types']:
         print(f"Instance ID: {instance['DBInstanceIdentifier']},  Instance Class: {instance['DBInstanceClass']}")
 
 
+def print_totals(totals, scanned, failed):
+    print(f"\n===== Totals: {scanned} targets scanned, {failed} failed =====")
+    print(f"Unencrypted RDS Instances: {totals['unencrypted_instances']}")
+    print(f"Unencrypted RDS Clusters: {totals['unencrypted_clusters']}")
+    for version, count in sorted(totals['postgresql_versions'].items()):
+        print(f"PostgreSQL Version: {version}, Instances: {count}")
+    for instance_class, count in sorted(totals['instance_classes'].items()):
+        print(f"Instance Class: {instance_class}, Instances: {count}")
+
+
+def main(profiles, regions, workers=DEFAULT_WORKERS):
+    # Scan every profile and region concurrently and print one merged report, exits non-zero if any scan failed
+    results = scan_targets(profiles, regions, workers)
+    for profile, region, report, error in results:
+        if len(results) > 1:
+            print(f"\n===== Profile: {profile}, Region: {region or 'default'} =====")
+        if error is not None:
+            print(f"ERROR: Could not scan profile '{profile}' in region {region or 'default'}: {error}")
+        else:
+            print_report(report)
+    reports = [report for _, _, report, error in results if error is None]
+    failed = len(results) - len(reports)
+    if len(results) > 1:
+        print_totals(combined_totals(reports), len(reports), failed)
+    write_metrics()
+    return 1 if failed else 0
+
+
 
 if __name__ == "__main__":
     # Initialize the argument parser
     parser = argparse.ArgumentParser(description="Find PostgreSQL RDS instances and their versions.")
-    parser.add_argument('--profile', help='The AWS profile to use.', required=True)
+    parser.add_argument('--profile', nargs='+', help='The AWS profiles to use.', required=True)
+    parser.add_argument('--region', nargs='+', default=[None], help='The AWS regions to scan (default: the profile region).')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of scans to run at the same time.')
     args = parser.parse_args()
 
-    profile = args.profile
-    
-
-    sys.exit(main(profile))
+    sys.exit(main(args.profile, args.region, args.workers))
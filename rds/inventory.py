@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import sys
+import time
+from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
+from snapshot_tools.backends import create_backend
+from snapshot_tools.client_provider import create_executor, get_client
+from snapshot_tools.inventory_table import INVENTORY_SOURCES, SNAPSHOT_RESOURCES, InventoryBuilder, InventoryTable, default_inventory_path, np
+from snapshot_tools.metrics import write_metrics
+from snapshot_tools.rds_inventory import RdsInventory
+from snapshot_tools.snapshot_stream import PAGE_SIZE
+
+# Upper bounds of the snapshot age buckets, in days
+AGE_BUCKETS = (7, 30, 90, 365)
+SECONDS_PER_DAY = 86400
+SOURCES = {source.resource: source for source in INVENTORY_SOURCES}
+
+
+def collect_databases(profile, region):
+    # DB instances and clusters of one target, listed the way findrds lists them; runs on an executor thread
+    return RdsInventory.collect(get_client('rds', region, profile), profile, region)
+
+
+async def collect_target(executor, profile, region):
+    # Rows of the snapshots, instances and clusters of one profile and region, snapshots added a page at a time
+    builder = InventoryBuilder()
+    async with create_backend(executor=executor, region_name=region, profile_name=profile) as backend:
+        account = (await backend.call('sts', 'get_caller_identity'))['Account']
+        region_name = await backend.region()
+
+        async def collect_snapshots(source):
+            async for page in backend.paginate('rds', source.operation, PaginationConfig={'PageSize': PAGE_SIZE}):
+                for item in page[source.list_key]:
+                    builder.add(account, region_name, source, item)
+
+        databases, *_ = await asyncio.gather(
+            asyncio.get_running_loop().run_in_executor(executor, collect_databases, profile, region),
+            *(collect_snapshots(source) for source in INVENTORY_SOURCES if source.resource in SNAPSHOT_RESOURCES)
+        )
+    for resource, items in (('db-instance', databases.instances), ('db-cluster', databases.clusters)):
+        for item in items:
+            builder.add(account, region_name, SOURCES[resource], item)
+    return builder
+
+
+async def export(path, profiles, regions):
+    # Write the rows of every target that could be listed, returns 1 if any target failed
+    targets = [(profile, region) for profile in profiles for region in regions]
+    executor = create_executor()
+    try:
+        results = await asyncio.gather(*(collect_target(executor, profile, region) for profile, region in targets),
+                                       return_exceptions=True)
+    finally:
+        executor.shutdown(wait=False)
+    builder = InventoryBuilder()
+    failed = 0
+    for (profile, region), result in zip(targets, results):
+        if isinstance(result, (ProfileNotFound, ClientError, BotoCoreError)):
+            print(f"ERROR: Could not scan profile '{profile}' in region {region or 'default'}: {result}")
+            failed += 1
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            builder.extend(result)
+    builder.table().save(path)
+    print(f"Wrote {len(builder)} rows of {len(targets) - failed} targets to {path}, {failed} failed")
+    return 1 if failed else 0
+
+
+def unencrypted_by_engine(table, mask, now):
+    # Unencrypted snapshot count and GiB per engine
+    mask = table.where(mask, resource=list(SNAPSHOT_RESOURCES), encrypted=False)
+    counts = table.group('engine', mask)
+    sizes = table.group('engine', mask, table.columns['size_gb'])
+    return ('engine', 'snapshots', 'unencrypted_gb'), sorted(
+        ((engine, int(counts[engine]), int(sizes.get(engine, 0))) for engine in counts), key=lambda row: -row[2])
+
+
+def snapshot_ages(table, mask, now):
+    # Snapshots, GiB and unencrypted GiB per age bucket; snapshots still being created have no age yet
+    mask = table.where(mask, resource=list(SNAPSHOT_RESOURCES)) & (table.columns['created'] > 0)
+    ages = (now - table.columns['created'][mask]) / SECONDS_PER_DAY
+    buckets = np.digitize(ages, AGE_BUCKETS)
+    sizes = table.columns['size_gb'][mask]
+    unencrypted = ~table.columns['encrypted'][mask]
+    counts = np.bincount(buckets, minlength=len(AGE_BUCKETS) + 1)
+    total_gb = np.bincount(buckets, weights=sizes, minlength=len(AGE_BUCKETS) + 1)
+    unencrypted_gb = np.bincount(buckets, weights=sizes * unencrypted, minlength=len(AGE_BUCKETS) + 1)
+    labels = [f'< {AGE_BUCKETS[0]}d'] + [f'{low}-{high}d' for low, high in zip(AGE_BUCKETS, AGE_BUCKETS[1:])] + [f'>= {AGE_BUCKETS[-1]}d']
+    return ('age', 'snapshots', 'total_gb', 'unencrypted_gb'), [
+        (label, int(count), int(total), int(unencrypted_total))
+        for label, count, total, unencrypted_total in zip(labels, counts, total_gb, unencrypted_gb)]
+
+
+def account_totals(table, mask, now):
+    # Per account and region: snapshots, their GiB, unencrypted GiB and unencrypted instances and clusters
+    snapshots = table.where(mask, resource=list(SNAPSHOT_RESOURCES))
+    unencrypted = ~table.columns['encrypted']
+    databases = table.where(mask, resource=['db-instance', 'db-cluster']) & unencrypted
+    # One code per account and region pair
+    account_codes, accounts = table.columns['account']
+    region_codes, regions = table.columns['region']
+    pairs = account_codes.astype('int64') * len(regions) + region_codes
+    size = len(accounts) * len(regions)
+    sizes = table.columns['size_gb']
+    columns = (
+        np.bincount(pairs[snapshots], minlength=size),
+        np.bincount(pairs[snapshots], weights=sizes[snapshots], minlength=size),
+        np.bincount(pairs[snapshots & unencrypted], weights=sizes[snapshots & unencrypted], minlength=size),
+        np.bincount(pairs[databases], minlength=size),
+    )
+    present = np.flatnonzero(np.bincount(pairs[mask], minlength=size))
+    return ('account', 'region', 'snapshots', 'total_gb', 'unencrypted_gb', 'unencrypted_databases'), [
+        (str(accounts[pair // len(regions)]), str(regions[pair % len(regions)]), *(int(column[pair]) for column in columns))
+        for pair in present]
+
+
+# Reports the query command can print, each one a few vectorized passes over the loaded columns
+REPORTS = {
+    'unencrypted-by-engine': unencrypted_by_engine,
+    'ages': snapshot_ages,
+    'accounts': account_totals,
+}
+
+
+def print_table(header, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print('  '.join(str(value).rjust(width) if isinstance(value, int) else str(value).ljust(width)
+                        for value, width in zip(row, widths)))
+
+
+def query(path, reports, accounts=None, regions=None, engines=None, older_than=None):
+    start = time.perf_counter()
+    table = InventoryTable.load(path)
+    loaded = time.perf_counter()
+    filters = {column: values for column, values in (('account', accounts), ('region', regions), ('engine', engines)) if values}
+    mask = table.where(**filters)
+    now = time.time()
+    if older_than is not None:
+        mask &= (table.columns['created'] > 0) & (table.columns['created'] < now - older_than * SECONDS_PER_DAY)
+    for name in reports:
+        report_start = time.perf_counter()
+        header, rows = REPORTS[name](table, mask, now)
+        elapsed = time.perf_counter() - report_start
+        print(f"\n{name} ({elapsed * 1000:.1f} ms):")
+        print_table(header, rows)
+    print(f"\n{len(table)} rows, {int(mask.sum())} matching, loaded in {(loaded - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the RDS snapshot and database inventory to a columnar file and query it offline.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='List snapshots, instances and clusters and write them to a file.')
+    export_parser.add_argument('--profile', nargs='+', default=[None], help='The AWS profiles to use (default: the default profile).')
+    export_parser.add_argument('--region', nargs='+', default=[None], help='The AWS regions to scan (default: the profile region).')
+    export_parser.add_argument('--output', default=default_inventory_path(), help="Inventory file, '.parquet' (needs pyarrow) or '.npz'.")
+    query_parser = commands.add_parser('query', help='Print reports from an exported file, without calling AWS.')
+    query_parser.add_argument('input', nargs='?', default=default_inventory_path(), help='Inventory file written by export.')
+    query_parser.add_argument('--report', nargs='+', choices=list(REPORTS), default=list(REPORTS), help='Reports to print.')
+    query_parser.add_argument('--account', nargs='+', help='Only these accounts.')
+    query_parser.add_argument('--region', nargs='+', help='Only these regions.')
+    query_parser.add_argument('--engine', nargs='+', help='Only these engines.')
+    query_parser.add_argument('--older-than', type=float, metavar='DAYS', help='Only resources created more than DAYS ago.')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        status = asyncio.run(export(args.output, args.profile, args.region))
+        write_metrics()
+    else:
+        query(args.input, args.report, args.account, args.region, args.engine, args.older_than)
+        status = 0
+    sys.exit(status)
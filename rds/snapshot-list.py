@@ -1,69 +1,49 @@
+import argparse
 import asyncio
-import boto3
 import logging
 import pprint
 import re
-from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from snapshot_tools.backends import create_backend
+from snapshot_tools.log_setup import LOGGER_NAME, debug_snapshot, setup_logging
+from snapshot_tools.metrics import write_metrics
+from snapshot_tools.snapshot_cache import DEFAULT_CACHE_TTL, FULL_RESYNC, SnapshotInventoryCache
 
-client = boto3.client('rds')
-executor = ThreadPoolExecutor()
+logger = logging.getLogger(LOGGER_NAME)
 
+async def list_rds_db_snapshots(backend, snapshot_cache, full_resync=FULL_RESYNC):
 
-# Create logger
-logger = logging.getLogger('my_app')
-logger.setLevel(logging.DEBUG)
-
-# Create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# Create file handler and set level to debug
-fh = logging.FileHandler('list.log')
-fh.setLevel(logging.DEBUG)
-
-# Add formatter to the handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(ch)
-logger.addHandler(fh)
-
-# Log messages
-logger.debug('This is a debug message')
-logger.info('This is an info message')
-
-def list_rds_db_snapshots():
-
-    rds_client = boto3.client('rds')
     db_snapshots_list = []
-    # Paginator for RDS DB snapshots
-    db_snapshot_paginator = rds_client.get_paginator('describe_db_snapshots')
-    # Iterate through pages of DB snapshots
-    #for page in db_snapshot_paginator.paginate(IncludeShared=True, IncludePublic=True):
-    #for page in db_snapshot_paginator.paginate():
-    for page in db_snapshot_paginator.paginate(SnapshotType='manual'):
-        for snapshot in page['DBSnapshots']:
-            if snapshot['Encrypted'] == False:
-                logger.debug(f"DBSnapshotIdentifier: {snapshot['DBSnapshotIdentifier']}, Status: {snapshot['Status']}, DBInstanceIdentifier: {snapshot['DBInstanceIdentifier']}, SnapshotType: {snapshot['SnapshotType']}, Engine: {snapshot['Engine']}, SnapshotCreateTime: {snapshot['SnapshotCreateTime']} , Encrypted: {snapshot['Encrypted']}")
-#                db_snapshots_list.append(snapshot)
-                db_snapshot_identifier = (snapshot['DBSnapshotIdentifier'])
-                match = re.search(r'[^:]+$' , db_snapshot_identifier)
-                if match:
-                    db_snapshot_identifier = match.group(0)
-                    db_snapshots_list.append(db_snapshot_identifier)
-#                db_snapshots_list.append(snapshot['DBSnapshotIdentifier'])
+    # Manual DB snapshots, served from the local inventory cache while it is fresh
+    async for snapshot in snapshot_cache.iter_db_snapshots(backend, full_resync):
+        if snapshot['Encrypted'] == False:
+            debug_snapshot(logger, snapshot)
+#            db_snapshots_list.append(snapshot)
+            db_snapshot_identifier = (snapshot['DBSnapshotIdentifier'])
+            match = re.search(r'[^:]+$' , db_snapshot_identifier)
+            if match:
+                db_snapshot_identifier = match.group(0)
+                db_snapshots_list.append(db_snapshot_identifier)
+#            db_snapshots_list.append(snapshot['DBSnapshotIdentifier'])
     return db_snapshots_list
 
 
 
-def main():
-    rds_db_snapshots_list = list_rds_db_snapshots()
+async def main(cache_ttl, full_resync):
+    async with create_backend() as backend:
+        snapshot_cache = SnapshotInventoryCache(ttl=cache_ttl)
+        rds_db_snapshots_list = await list_rds_db_snapshots(backend, snapshot_cache, full_resync)
     for snap in rds_db_snapshots_list:
         pprint.pprint(snap)
+    write_metrics()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="List unencrypted manual RDS DB snapshots.")
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_CACHE_TTL, help='Seconds the cached snapshot inventory is used without a refresh.')
+    parser.add_argument('--full-resync', action='store_true', default=FULL_RESYNC, help='Ignore the cache and list every snapshot again.')
+    args = parser.parse_args()
+
+    # Log through a background writer thread, level and format come from the environment
+    setup_logging('list.log')
+    asyncio.run(main(args.cache_ttl, args.full_resync))
@@ -0,0 +1,59 @@
+"""Shared snapshot helpers for the scripts and for wrappers such as Lambda handlers and cron jobs.
+
+Importing the package imports none of its modules: each name below is
+loaded from its module on first access, so a wrapper only pays for what it
+uses. Nothing here connects anywhere or opens files when imported; backends
+create their executor and clients, and the stores open their databases, on
+first use. The scripts in rds/ import it as a sibling directory, anything
+else imports it once the repository is installed with ``pip install .``.
+
+    from snapshot_tools import create_backend, stream_unencrypted_snapshots, DB_SNAPSHOT
+"""
+import importlib
+
+# Public name -> module it is loaded from
+_EXPORTS = {
+    # Backends
+    'create_backend': 'backends',
+    'StubBackend': 'stub_backend',
+    # Listing
+    'DB_SNAPSHOT': 'snapshot_kinds',
+    'CLUSTER_SNAPSHOT': 'snapshot_kinds',
+    'SNAPSHOT_KINDS': 'snapshot_kinds',
+    'SnapshotRef': 'snapshot_kinds',
+    'stream_snapshots': 'snapshot_stream',
+    'stream_snapshot_refs': 'snapshot_stream',
+    'stream_unencrypted_snapshots': 'snapshot_engine',
+    'snapshot_inventory': 'delete_planner',
+    'SnapshotInventoryCache': 'snapshot_cache',
+    # Status checks
+    'describe_snapshot_statuses': 'snapshot_poller',
+    'SnapshotStatusPoller': 'snapshot_poller',
+    # Copy and delete
+    'copy_encrypted_snapshot': 'snapshot_engine',
+    'copy_snapshot_to_region': 'snapshot_engine',
+    'delete_snapshot': 'snapshot_engine',
+    'delete_when_encrypted': 'snapshot_engine',
+    'build_delete_plan': 'delete_planner',
+    'execute_delete_plan': 'delete_planner',
+    'SnapshotJobStore': 'job_store',
+    # KMS
+    'get_or_create_kms_key': 'kms_keys',
+    'KmsKeyCache': 'kms_keys',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    # Later lookups no longer go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
@@ -0,0 +1,134 @@
+import asyncio
+import os
+from contextlib import AsyncExitStack
+from .client_provider import RECORD, client_config, create_executor, get_client
+from .metrics import register_metrics
+from .rate_limiter import client_bucket, register_rate_limits_async
+
+# Connections per client for the aio backend, which has no thread limit
+AIO_MAX_POOL_CONNECTIONS = 100
+# Backend used when none is given: 'executor' (boto3 in threads) or 'aio' (aiobotocore)
+DEFAULT_BACKEND = os.environ.get('SNAPSHOT_TOOLS_BACKEND', 'executor')
+
+
+class ExecutorBackend:
+    """Run boto3 calls from the event loop on a thread pool.
+
+    Every in-flight request holds one executor thread. Calls wait for the
+    shared rate limiter on the event loop before they are handed to the
+    pool, so a throttled API family does not hold threads other calls need.
+    """
+
+    def __init__(self, executor=None, region_name=None, profile_name=None):
+        self.executor = executor or create_executor()
+        self.region_name = region_name
+        self.profile_name = profile_name
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def region(self):
+        return self._client('rds').meta.region_name
+
+    def _client(self, service_name):
+        # The clients only record responses, calls wait for the rate limiter in _wait_for_token
+        return get_client(service_name, self.region_name, self.profile_name, rate_limit=RECORD)
+
+    async def _wait_for_token(self, client, operation_name):
+        bucket = client_bucket(client, operation_name, self.profile_name)
+        if bucket is not None:
+            await bucket.acquire_async()
+
+    def _call(self, service_name, operation_name, kwargs):
+        return getattr(self._client(service_name), operation_name)(**kwargs)
+
+    async def call(self, service_name, operation_name, **kwargs):
+        loop = asyncio.get_running_loop()
+        await self._wait_for_token(self._client(service_name), operation_name)
+        return await loop.run_in_executor(self.executor, self._call, service_name, operation_name, kwargs)
+
+    async def paginate(self, service_name, operation_name, **kwargs):
+        loop = asyncio.get_running_loop()
+        client = self._client(service_name)
+        pages = iter(client.get_paginator(operation_name).paginate(**kwargs))
+        while True:
+            await self._wait_for_token(client, operation_name)
+            # Each page is fetched on the executor so the event loop never blocks
+            page = await loop.run_in_executor(self.executor, next, pages, None)
+            if page is None:
+                break
+            yield page
+
+
+class AioBackend:
+    """Await botocore calls natively on the event loop with aiobotocore.
+
+    Thousands of concurrent waits share one event loop and one connection
+    pool per client instead of one thread per in-flight request. Set
+    ``endpoint_url`` (or ``AWS_ENDPOINT_URL``) to run against a local stub
+    such as ``moto_server``.
+    """
+
+    def __init__(self, region_name=None, profile_name=None, endpoint_url=None):
+        # Imported here, aiobotocore and aiohttp take longer to import than the executor backend needs to start
+        try:
+            from aiobotocore.session import get_session
+        except ImportError:
+            raise RuntimeError("The 'aio' backend needs the aiobotocore package installed.") from None
+        self.region_name = region_name
+        self.profile_name = profile_name
+        self.endpoint_url = endpoint_url
+        self._session = get_session()
+        if profile_name:
+            self._session.set_config_variable('profile', profile_name)
+        self._clients = {}
+        self._lock = asyncio.Lock()
+        self._exit_stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        await self._exit_stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._clients.clear()
+        return await self._exit_stack.__aexit__(*exc_info)
+
+    async def client(self, service_name):
+        client = self._clients.get(service_name)
+        if client is None:
+            async with self._lock:
+                client = self._clients.get(service_name)
+                if client is None:
+                    client = await self._exit_stack.enter_async_context(self._session.create_client(
+                        service_name,
+                        region_name=self.region_name,
+                        endpoint_url=self.endpoint_url,
+                        config=client_config(AIO_MAX_POOL_CONNECTIONS)
+                    ))
+                    self._clients[service_name] = register_metrics(register_rate_limits_async(client, self.profile_name))
+        return client
+
+    async def region(self):
+        return (await self.client('rds')).meta.region_name
+
+    async def call(self, service_name, operation_name, **kwargs):
+        client = await self.client(service_name)
+        return await getattr(client, operation_name)(**kwargs)
+
+    async def paginate(self, service_name, operation_name, **kwargs):
+        client = await self.client(service_name)
+        async for page in client.get_paginator(operation_name).paginate(**kwargs):
+            yield page
+
+
+def create_backend(name=None, executor=None, region_name=None, profile_name=None, endpoint_url=None):
+    # Build the backend named by name or SNAPSHOT_TOOLS_BACKEND, use it with 'async with'
+    name = name or DEFAULT_BACKEND
+    if name == 'aio':
+        return AioBackend(region_name, profile_name, endpoint_url)
+    if name == 'executor':
+        return ExecutorBackend(executor, region_name, profile_name)
+    raise ValueError(f"Unknown backend '{name}', expected 'executor' or 'aio'.")
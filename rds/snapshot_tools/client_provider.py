@@ -0,0 +1,49 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import register_metrics
+from .rate_limiter import register_rate_limits
+
+# Worker threads per executor, same default as ThreadPoolExecutor
+EXECUTOR_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Attempts per API call, including the first one
+RETRY_MAX_ATTEMPTS = 5
+# Rate limiting of a client from get_client: wait for the limiter in the calling thread, or only record responses
+WAIT = 'wait'
+RECORD = 'record'
+
+_local = threading.local()
+
+
+def client_config(max_workers=EXECUTOR_WORKERS):
+    # Keep one warm connection per executor thread instead of botocore's default of 10
+    return Config(
+        max_pool_connections=max_workers,
+        retries={'max_attempts': RETRY_MAX_ATTEMPTS, 'mode': 'standard'}
+    )
+
+
+def get_client(service_name, region_name=None, profile_name=None, rate_limit=WAIT):
+    # Return a client cached for this thread, region, profile and rate limiting: WAIT blocks each attempt
+    # until the shared rate limiter lets it through, RECORD only reports responses to the limiter and
+    # None leaves the limiter out
+    clients = getattr(_local, 'clients', None)
+    if clients is None:
+        clients = _local.clients = {}
+    key = (service_name, region_name, profile_name, rate_limit)
+    client = clients.get(key)
+    if client is None:
+        session = boto3.Session(profile_name=profile_name, region_name=region_name)
+        client = session.client(service_name, config=client_config())
+        if rate_limit is not None:
+            client = register_rate_limits(client, profile_name, wait=rate_limit == WAIT)
+        client = register_metrics(client)
+        clients[key] = client
+    return client
+
+
+def create_executor(max_workers=EXECUTOR_WORKERS):
+    # Executor sized to match the connection pool of the cached clients
+    return ThreadPoolExecutor(max_workers=max_workers)
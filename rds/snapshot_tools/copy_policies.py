@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import os
+from collections import OrderedDict, deque
+
+# Policy used when none is given, see SCHEDULING_POLICIES; 'fifo' copies in listing order
+DEFAULT_COPY_POLICY = os.environ.get('SNAPSHOT_COPY_POLICY', 'fifo')
+# Listed snapshots a policy chooses from at most; copies start with whatever is listed so far,
+# the rest of the window is read while they run
+DEFAULT_LOOKAHEAD = int(os.environ.get('SNAPSHOT_COPY_LOOKAHEAD', '1000'))
+
+
+def _allocated_storage(snapshot):
+    return getattr(snapshot, 'allocated_storage', None) or 0
+
+
+class FifoPolicy:
+    """Copy snapshots in the order they were listed."""
+
+    def __init__(self):
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, snapshot):
+        self._queue.append(snapshot)
+
+    def pop(self):
+        return self._queue.popleft()
+
+
+class SmallestFirstPolicy:
+    """Shortest job first: the smallest snapshots finish, and free their storage, soonest."""
+
+    _sign = 1
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, snapshot):
+        # The listing order breaks ties, so equal sizes keep their order
+        heapq.heappush(self._heap, (self._sign * _allocated_storage(snapshot), next(self._order), snapshot))
+
+    def pop(self):
+        return heapq.heappop(self._heap)[2]
+
+
+class LargestFirstPolicy(SmallestFirstPolicy):
+    """Start the longest copies first, so they do not all end up at the tail of the run."""
+
+    _sign = -1
+
+
+class RoundRobinPolicy:
+    """Take one snapshot of each source instance or cluster in turn.
+
+    A database with hundreds of snapshots cannot hold every copy slot, and
+    within each source the smallest snapshot goes first.
+    """
+
+    def __init__(self):
+        self._sources = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, snapshot):
+        source = (getattr(snapshot, 'kind', None), getattr(snapshot, 'source', None))
+        queue = self._sources.get(source)
+        if queue is None:
+            queue = self._sources[source] = SmallestFirstPolicy()
+        queue.push(snapshot)
+        self._size += 1
+
+    def pop(self):
+        source, queue = next(iter(self._sources.items()))
+        snapshot = queue.pop()
+        del self._sources[source]
+        if queue:
+            # Back to the end of the rotation
+            self._sources[source] = queue
+        self._size -= 1
+        return snapshot
+
+
+SCHEDULING_POLICIES = {
+    'fifo': FifoPolicy,
+    'smallest-first': SmallestFirstPolicy,
+    'largest-first': LargestFirstPolicy,
+    'round-robin': RoundRobinPolicy,
+}
+
+
+def create_policy(name=None):
+    name = name or DEFAULT_COPY_POLICY
+    try:
+        return SCHEDULING_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown copy policy '{name}', expected one of {', '.join(SCHEDULING_POLICIES)}.") from None
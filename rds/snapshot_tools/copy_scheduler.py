@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from collections import deque
+from botocore.exceptions import ClientError
+from .copy_policies import DEFAULT_LOOKAHEAD, create_policy
+from .metrics import copies, copies_in_flight, copies_queued
+
+logger = logging.getLogger('my_app')
+
+# Snapshot copies RDS lets one account run at the same time in a region
+MAX_CONCURRENT_COPIES = 20
+# Seconds to wait before retrying when a quota error leaves nothing in flight
+QUOTA_RETRY_DELAY = 60
+
+
+class CopyQuotaExceeded(Exception):
+    """Raised by a copy function when RDS refuses a copy because of a quota."""
+
+
+async def get_manual_snapshot_quota(backend):
+    # Number of manual snapshots that can still be created, or None if unknown
+    try:
+        response = await backend.call('rds', 'describe_account_attributes')
+    except ClientError as e:
+        logger.info("ERROR: Could not read the account snapshot quota: %s", e)
+        return None
+    for quota in response['AccountQuotas']:
+        if quota['AccountQuotaName'] == 'ManualSnapshots':
+            return quota['Max'] - quota['Used']
+    return None
+
+
+class CopyScheduler:
+    """Keep as many snapshot copies in flight as the quotas allow.
+
+    ``start_copy(snapshot)`` starts one copy and returns a result, or None if
+    the copy could not be started. ``wait_for_copy(snapshot, result)`` returns
+    once the copy has finished and its slot can be reused. A copy that raises
+    ``CopyQuotaExceeded`` is put back at the front of the queue and retried
+    once another copy finishes, and the admission limit is lowered to the
+    number of copies RDS accepted. Each finished copy raises the limit by one
+    again, up to the configured maximum. A copy that could not be started
+    or raised any other error fails only itself and is counted in
+    ``failed``.
+
+    Which listed snapshot starts next is up to ``policy`` (see
+    ``copy_policies``), which chooses among up to ``lookahead`` snapshots
+    read ahead from the listing. The listing is read in the background, so
+    copies start with the first listed page and later pages only refine
+    the order. ``stage`` labels the copy metrics when
+    several schedulers run side by side.
+    """
+
+    def __init__(self, start_copy, wait_for_copy, max_in_flight=MAX_CONCURRENT_COPIES, snapshot_quota=None,
+                 policy=None, lookahead=DEFAULT_LOOKAHEAD, stage='encrypt'):
+        self.start_copy = start_copy
+        self.wait_for_copy = wait_for_copy
+        self.max_in_flight = max_in_flight
+        if snapshot_quota is not None:
+            # Every copy holds one extra manual snapshot until its original is deleted
+            self.max_in_flight = max(1, min(max_in_flight, snapshot_quota))
+        self.limit_ceiling = max_in_flight
+        self.policy = policy if policy is not None else create_policy()
+        self.lookahead = max(1, lookahead)
+        self.stage = stage
+        self.completed = 0
+        self.failed = 0
+
+    async def _copy(self, snapshot):
+        # Outcome of one copy: 'completed', 'requeued' after a quota error, or 'failed' if it could not be
+        # started or raised any other error
+        try:
+            result = await self.start_copy(snapshot)
+            if result is None:
+                # start_copy already logged why the copy could not be started
+                return snapshot, 'failed'
+            await self.wait_for_copy(snapshot, result)
+        except CopyQuotaExceeded:
+            return snapshot, 'requeued'
+        except Exception:
+            logger.exception("ERROR: Copy of %s failed", snapshot)
+            return snapshot, 'failed'
+        return snapshot, 'completed'
+
+    async def _read_ahead(self, source, arrived, room):
+        # Keep up to lookahead listed snapshots in the policy, reading on only while there is room
+        try:
+            while True:
+                while len(self.policy) >= self.lookahead:
+                    room.clear()
+                    await room.wait()
+                try:
+                    snapshot = await anext(source)
+                except StopAsyncIteration:
+                    return
+                self.policy.push(snapshot)
+                arrived.set()
+        finally:
+            arrived.set()
+
+    async def run(self, snapshots):
+        # snapshots is a list or an async iterator, the iterator is read in the background to keep the
+        # lookahead window full; a copy starts as soon as a slot is free and any snapshot has been listed
+        source = aiter(snapshots) if hasattr(snapshots, '__aiter__') else _from_iterable(snapshots)
+        queue = deque()
+        in_flight = set()
+        arrived = asyncio.Event()
+        room = asyncio.Event()
+        reader = asyncio.create_task(self._read_ahead(source, arrived, room))
+        logger.info("Scheduling %s copies with up to %d in flight, %s over %d listed snapshots",
+                    self.stage, self.max_in_flight, type(self.policy).__name__, self.lookahead)
+        try:
+            while True:
+                while len(in_flight) < self.max_in_flight:
+                    if queue:
+                        snapshot = queue.popleft()
+                    elif self.policy:
+                        snapshot = self.policy.pop()
+                        room.set()
+                    else:
+                        break
+                    in_flight.add(asyncio.create_task(self._copy(snapshot)))
+                copies_in_flight.set(len(in_flight), stage=self.stage)
+                copies_queued.set(len(queue), stage=self.stage)
+                if not in_flight and reader.done():
+                    # Raises the error of a failed listing
+                    reader.result()
+                    break
+                waiting = set(in_flight)
+                arrival = None
+                if len(in_flight) < self.max_in_flight and not reader.done():
+                    # A free slot waits for the next listed snapshot as well as for a finished copy
+                    arrived.clear()
+                    arrival = asyncio.create_task(arrived.wait())
+                    waiting.add(arrival)
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if arrival is not None:
+                    arrival.cancel()
+                    done.discard(arrival)
+                in_flight -= done
+                requeued = []
+                for task in done:
+                    snapshot, result = task.result()
+                    copies.inc(stage=self.stage, result=result)
+                    if result == 'requeued':
+                        requeued.append(snapshot)
+                        continue
+                    if result == 'completed':
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                    self.max_in_flight = min(self.limit_ceiling, self.max_in_flight + 1)
+                if requeued:
+                    queue.extendleft(reversed(requeued))
+                    self.max_in_flight = max(1, len(in_flight))
+                    logger.info("Snapshot quota reached, requeued %d copies and limited copies in flight to %d", len(requeued), self.max_in_flight)
+                    if not in_flight:
+                        await asyncio.sleep(QUOTA_RETRY_DELAY)
+        finally:
+            # Copies still in flight when run() is cancelled or the listing fails are not left behind
+            reader.cancel()
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(reader, *in_flight, return_exceptions=True)
+        logger.info("Finished %d %s copies, %d failed", self.completed, self.stage, self.failed)
+
+
+async def _from_iterable(snapshots):
+    for snapshot in snapshots:
+        yield snapshot
@@ -0,0 +1,144 @@
+import asyncio
+import fnmatch
+import logging
+from collections import namedtuple
+from .metrics import reclaimed_storage
+from .snapshot_engine import ENCRYPTED_SUFFIX, delete_snapshot
+from .snapshot_kinds import DB_SNAPSHOT, SNAPSHOT_KINDS, SnapshotRef
+from .snapshot_stream import stream_snapshot_refs
+
+logger = logging.getLogger('my_app')
+
+# Deletes running at the same time
+DELETE_CONCURRENCY = 10
+# Encrypted copy states that can still become available
+IN_PROGRESS_STATUSES = ('creating', 'copying', 'pending')
+
+# Unencrypted original and its encrypted copy, as SnapshotRefs of the same kind
+DeletePair = namedtuple('DeletePair', 'original encrypted_identifier')
+
+
+def parse_delete_requests(lines):
+    # Yield (kind, original identifier or None, encrypted identifier or glob pattern) for each input line.
+    # A line is an encrypted copy ID, or an original and its copy separated by whitespace, optionally
+    # prefixed with 'cluster:' or 'db:'; glob patterns such as 'looker-*-encrypted' select encrypted
+    # copies from the inventory. Blank lines and '#' comments are skipped.
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        kind = DB_SNAPSHOT
+        prefix, separator, rest = line.partition(':')
+        if separator and prefix in SNAPSHOT_KINDS:
+            kind, line = SNAPSHOT_KINDS[prefix], rest.strip()
+        fields = line.split()
+        if len(fields) == 2:
+            yield kind, fields[0], fields[1]
+        elif len(fields) == 1:
+            yield kind, None, fields[0]
+        else:
+            logger.info(f"ERROR: Ignoring delete request line '{line}'")
+
+
+def _original_identifier(encrypted_identifier):
+    return encrypted_identifier.removesuffix(f'-{ENCRYPTED_SUFFIX}')
+
+
+def _is_pattern(identifier):
+    return any(character in identifier for character in '*?[')
+
+
+class DeletePlan:
+    """What to do with each requested pair, from one inventory sweep.
+
+    ``delete`` holds pairs whose encrypted copy is already available,
+    ``wait`` pairs whose copy is still being made, ``keep`` pairs whose copy
+    is missing, unencrypted or failed, or whose original is encrypted (with
+    the reason) and ``done`` pairs whose original is already gone.
+    """
+
+    def __init__(self):
+        self.delete = []
+        self.wait = []
+        self.keep = []
+        self.done = []
+
+    def summary(self):
+        return (f"{len(self.delete)} to delete now, {len(self.wait)} waiting for their encrypted copy, "
+                f"{len(self.keep)} kept, {len(self.done)} already deleted")
+
+
+async def snapshot_inventory(backend, kinds):
+    # Manual snapshots of the given kinds as SnapshotRefs by identifier, with one paginated listing per kind
+    inventory = {}
+    for kind in kinds:
+        inventory[kind] = {snapshot.identifier: snapshot
+                           async for snapshot in stream_snapshot_refs(backend, kind, SnapshotType='manual')}
+    return inventory
+
+
+async def build_delete_plan(backend, lines):
+    requests = list(parse_delete_requests(lines))
+    inventory = await snapshot_inventory(backend, {kind for kind, _, _ in requests})
+    plan = DeletePlan()
+    planned = set()
+    for kind, original_identifier, encrypted in requests:
+        snapshots = inventory[kind]
+        if _is_pattern(encrypted):
+            matches = [(_original_identifier(identifier), identifier) for identifier in snapshots
+                       if fnmatch.fnmatchcase(identifier, encrypted) and snapshots[identifier].encrypted]
+            if not matches:
+                logger.info(f"No {kind.label} matches '{encrypted}'")
+        else:
+            matches = [(original_identifier or _original_identifier(encrypted), encrypted)]
+        for original_identifier, encrypted_identifier in matches:
+            if (kind, original_identifier) in planned or original_identifier == encrypted_identifier:
+                continue
+            planned.add((kind, original_identifier))
+            _plan_pair(plan, kind, snapshots, original_identifier, encrypted_identifier)
+    return plan
+
+
+def _plan_pair(plan, kind, snapshots, original_identifier, encrypted_identifier):
+    original = snapshots.get(original_identifier)
+    pair = DeletePair(original or SnapshotRef(kind, original_identifier), encrypted_identifier)
+    encrypted = snapshots.get(encrypted_identifier)
+    if original is None:
+        plan.done.append(pair)
+    elif original.encrypted:
+        # Swapped or mistyped pair, deleting it would lose an encrypted snapshot
+        plan.keep.append((pair, 'original is encrypted'))
+    elif encrypted is None:
+        plan.keep.append((pair, 'encrypted copy not found'))
+    elif not encrypted.encrypted:
+        plan.keep.append((pair, 'copy is not encrypted'))
+    elif encrypted.status == 'available':
+        plan.delete.append(pair)
+    elif encrypted.status in IN_PROGRESS_STATUSES:
+        plan.wait.append(pair)
+    else:
+        plan.keep.append((pair, f"encrypted copy is {encrypted.status}"))
+
+
+async def execute_delete_plan(backend, plan, poller, concurrency=DELETE_CONCURRENCY):
+    # Delete originals whose copy is available right away and the others once the poller reports their copy,
+    # with at most concurrency deletes at a time; returns the number of originals deleted
+    slots = asyncio.Semaphore(concurrency)
+
+    async def delete_now(pair):
+        async with slots:
+            deleted = await delete_snapshot(backend, pair.original)
+        if deleted and pair.original.allocated_storage:
+            reclaimed_storage.inc(pair.original.allocated_storage, kind=pair.original.kind.name)
+        return deleted
+
+    async def delete_later(pair):
+        # Waiting does not hold a slot, only the delete call does
+        status = await poller.wait_for_status(pair.encrypted_identifier, kind=pair.original.kind)
+        if status != 'available':
+            logger.info(f"ERROR: Encrypted {pair.original.kind.label} {pair.encrypted_identifier} ended in state {status}, keeping {pair.original.identifier}")
+            return False
+        return await delete_now(pair)
+
+    results = await asyncio.gather(*map(delete_now, plan.delete), *map(delete_later, plan.wait))
+    return sum(results)
@@ -0,0 +1,193 @@
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Columns whose values repeat, stored as integer codes into a table of distinct values
+STRING_COLUMNS = ('account', 'region', 'resource', 'identifier', 'instance', 'engine', 'engine_version', 'status')
+# Other columns and their array type codes: size in GiB, encryption flag and creation time in epoch seconds (0 if unknown)
+NUMERIC_COLUMNS = {'size_gb': 'l', 'encrypted': 'b', 'created': 'q'}
+NUMPY_TYPES = {'size_gb': 'int32', 'encrypted': 'bool', 'created': 'int64'}
+# File format by extension, Parquet needs pyarrow and the NumPy archive only numpy
+FORMATS = {'.parquet': 'parquet', '.npz': 'npz'}
+
+# An RDS listing the inventory is built from, and the response fields of each column
+InventorySource = namedtuple('InventorySource', 'resource operation list_key identifier instance encrypted created status')
+
+INVENTORY_SOURCES = (
+    InventorySource('db-snapshot', 'describe_db_snapshots', 'DBSnapshots', 'DBSnapshotIdentifier',
+                    'DBInstanceIdentifier', 'Encrypted', 'SnapshotCreateTime', 'Status'),
+    InventorySource('cluster-snapshot', 'describe_db_cluster_snapshots', 'DBClusterSnapshots', 'DBClusterSnapshotIdentifier',
+                    'DBClusterIdentifier', 'StorageEncrypted', 'SnapshotCreateTime', 'Status'),
+    InventorySource('db-instance', 'describe_db_instances', 'DBInstances', 'DBInstanceIdentifier',
+                    'DBInstanceIdentifier', 'StorageEncrypted', 'InstanceCreateTime', 'DBInstanceStatus'),
+    InventorySource('db-cluster', 'describe_db_clusters', 'DBClusters', 'DBClusterIdentifier',
+                    'DBClusterIdentifier', 'StorageEncrypted', 'ClusterCreateTime', 'Status'),
+)
+SNAPSHOT_RESOURCES = ('db-snapshot', 'cluster-snapshot')
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Inventory tables need the numpy package installed.")
+
+
+class InventoryBuilder:
+    """Collect inventory rows into compact columns while the listings are read.
+
+    Every string is replaced by a code into the distinct values of its
+    column and every column is a typed ``array``, so a row costs a few
+    dozen bytes and the describe responses can be dropped page by page.
+    """
+
+    def __init__(self):
+        self._values = {column: {} for column in STRING_COLUMNS}
+        self._columns = {column: array('i') for column in STRING_COLUMNS}
+        self._columns.update((column, array(typecode)) for column, typecode in NUMERIC_COLUMNS.items())
+
+    def __len__(self):
+        return len(self._columns['identifier'])
+
+    def _append_string(self, column, value):
+        values = self._values[column]
+        code = values.get(value)
+        if code is None:
+            code = values[value] = len(values)
+        self._columns[column].append(code)
+
+    def add(self, account, region, source, item):
+        created = item.get(source.created)
+        for column, value in (('account', account), ('region', region), ('resource', source.resource),
+                              ('identifier', item[source.identifier]), ('instance', item.get(source.instance) or ''),
+                              ('engine', item.get('Engine') or ''), ('engine_version', item.get('EngineVersion') or ''),
+                              ('status', item.get(source.status) or '')):
+            self._append_string(column, value)
+        self._columns['size_gb'].append(item.get('AllocatedStorage') or 0)
+        self._columns['encrypted'].append(bool(item.get(source.encrypted)))
+        self._columns['created'].append(int(created.timestamp()) if created else 0)
+
+    def extend(self, other):
+        # Append the rows of another builder, recoding its strings into this builder's values
+        for column in STRING_COLUMNS:
+            values = list(other._values[column])
+            for code in other._columns[column]:
+                self._append_string(column, values[code])
+        for column in NUMERIC_COLUMNS:
+            self._columns[column].extend(other._columns[column])
+
+    def table(self):
+        _require_numpy()
+        columns = {column: (self._numpy(column, 'int32'), np.array(list(self._values[column]), dtype=str))
+                   for column in STRING_COLUMNS}
+        columns.update((column, self._numpy(column, dtype)) for column, dtype in NUMPY_TYPES.items())
+        return InventoryTable(columns)
+
+    def _numpy(self, column, dtype):
+        # Copy the column out of its array, whose buffer keeps growing while rows are added
+        values = self._columns[column]
+        return np.frombuffer(values, dtype=np.dtype(values.typecode)).astype(dtype)
+
+
+class InventoryTable:
+    """The inventory as NumPy columns, queried without any AWS call.
+
+    String columns are ``(codes, values)`` pairs, so filters compare
+    integers and groupings are a ``bincount`` over the codes.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['size_gb'])
+
+    def code(self, column, value):
+        # Code of a value in a string column, -1 if no row has it
+        codes, values = self.columns[column]
+        matches = np.flatnonzero(values == value)
+        return int(matches[0]) if len(matches) else -1
+
+    def where(self, mask=None, **equals):
+        # Rows whose columns equal the given values, combined with mask; a list or tuple matches any of its values
+        result = np.ones(len(self), dtype=bool) if mask is None else mask.copy()
+        for column, expected in equals.items():
+            choices = expected if isinstance(expected, (list, tuple)) else (expected,)
+            if column in STRING_COLUMNS:
+                codes = self.columns[column][0]
+                result &= np.isin(codes, [self.code(column, value) for value in choices])
+            else:
+                result &= np.isin(self.columns[column], choices)
+        return result
+
+    def group(self, column, mask, weights=None):
+        # Number of rows, or sum of weights, per value of a string column among the masked rows
+        codes, values = self.columns[column]
+        sums = np.bincount(codes[mask], weights=None if weights is None else weights[mask], minlength=len(values))
+        return {str(values[code]): sums[code] for code in np.flatnonzero(sums)}
+
+    def string_values(self, column, mask):
+        codes, values = self.columns[column]
+        return values[codes[mask]]
+
+    def save(self, path):
+        file_format = _file_format(path)
+        if file_format == 'parquet':
+            _require_pyarrow()
+            table = pa.table({
+                **{column: pa.DictionaryArray.from_arrays(*self.columns[column]) for column in STRING_COLUMNS},
+                **{column: self.columns[column] for column in NUMERIC_COLUMNS},
+            })
+            pq.write_table(table, path, compression='zstd')
+        else:
+            arrays = {column: self.columns[column] for column in NUMERIC_COLUMNS}
+            for column in STRING_COLUMNS:
+                arrays[f'{column}.codes'], arrays[f'{column}.values'] = self.columns[column]
+            # np.savez appends '.npz' to any other name
+            with open(path, 'wb') as inventory_file:
+                np.savez_compressed(inventory_file, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        _require_numpy()
+        if _file_format(path) == 'parquet':
+            _require_pyarrow()
+            table = pq.read_table(path)
+            columns = {column: table.column(column).to_numpy().astype(NUMPY_TYPES[column]) for column in NUMERIC_COLUMNS}
+            for column in STRING_COLUMNS:
+                encoded = table.column(column).combine_chunks()
+                if not pa.types.is_dictionary(encoded.type):
+                    encoded = encoded.dictionary_encode()
+                columns[column] = (encoded.indices.to_numpy(zero_copy_only=False).astype('int32'),
+                                   encoded.dictionary.to_numpy(zero_copy_only=False).astype(str))
+            return cls(columns)
+        with np.load(path) as archive:
+            columns = {column: archive[column] for column in NUMERIC_COLUMNS}
+            for column in STRING_COLUMNS:
+                columns[column] = (archive[f'{column}.codes'], archive[f'{column}.values'])
+        return cls(columns)
+
+
+def _file_format(path):
+    for extension, file_format in FORMATS.items():
+        if path.endswith(extension):
+            return file_format
+    raise ValueError(f"Unknown inventory file '{path}', expected one of {', '.join(FORMATS)}.")
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError("Parquet inventory files need the pyarrow package installed, or use a '.npz' file.")
+
+
+def default_inventory_path():
+    # Parquet when pyarrow is installed, otherwise the NumPy archive
+    return 'inventory.parquet' if pq is not None else 'inventory.npz'
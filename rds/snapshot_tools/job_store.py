@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger('my_app')
+
+PENDING = 'pending'
+COPYING = 'copying'
+AVAILABLE = 'available'
+DELETED = 'deleted'
+FAILED = 'failed'
+
+# Allowed state changes of a snapshot job
+TRANSITIONS = {
+    PENDING: (COPYING, FAILED),
+    COPYING: (AVAILABLE, FAILED, PENDING),
+    AVAILABLE: (DELETED, FAILED),
+    FAILED: (PENDING,),
+    DELETED: (),
+}
+# States a restarted run still has work for
+OPEN_STATES = (PENDING, COPYING, AVAILABLE)
+# Buffered transitions written in one transaction
+FLUSH_BATCH_SIZE = 500
+# Seconds between flushes of the transition buffer
+FLUSH_INTERVAL = 1.0
+# Jobs read per query when streaming the jobs of a state
+JOB_BATCH_SIZE = 1000
+
+
+class SnapshotJobStore:
+    """SQLite store of snapshot encryption jobs that survives restarts.
+
+    Each original snapshot is one keyed row moving through pending, copying,
+    available (copy done, original not yet deleted), deleted or failed.
+    Transitions are buffered and written in batched transactions on a WAL
+    database, and each one only applies if the row is still in the expected
+    state, so a restarted run continues from the stored states.
+    """
+
+    def __init__(self, path='rds_snapshots.db'):
+        self.path = path
+        self._conn = None
+        self._buffer = []
+        self._buffered_status = {}
+
+    @property
+    def conn(self):
+        # The database is opened and migrated on first use, so creating a store does no I/O
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS snapshot_jobs (
+                    snapshot_id TEXT PRIMARY KEY,
+                    encrypted_snapshot_id TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS snapshot_jobs_status ON snapshot_jobs (status)')
+            conn.execute('CREATE TABLE IF NOT EXISTS store_state (name TEXT PRIMARY KEY, value TEXT)')
+            _import_legacy_rows(conn)
+        return conn
+
+    def has_open_jobs(self, statuses=OPEN_STATES):
+        counts = self.counts()
+        return any(counts.get(status) for status in statuses)
+
+    def listing_complete(self):
+        # Whether the last listing of unencrypted snapshots stored all of its jobs
+        row = self.conn.execute("SELECT value FROM store_state WHERE name = 'listing_complete'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def set_listing_complete(self, complete):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO store_state VALUES ('listing_complete', ?)", ('1' if complete else '0',))
+
+    def add_pending(self, snapshot_ids):
+        # Register new snapshots in one transaction, keeping the state of known ones,
+        # and return the given IDs whose job is pending, new or not
+        snapshot_ids = list(snapshot_ids)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO snapshot_jobs (snapshot_id, status, updated_at) VALUES (?, ?, ?)",
+                ((snapshot_id, PENDING, now) for snapshot_id in snapshot_ids)
+            )
+        placeholders = ', '.join('?' for _ in snapshot_ids)
+        stored = dict(self.conn.execute(
+            f'SELECT snapshot_id, status FROM snapshot_jobs WHERE snapshot_id IN ({placeholders})', snapshot_ids
+        ).fetchall())
+        return [snapshot_id for snapshot_id in snapshot_ids
+                if self._buffered_status.get(snapshot_id, stored.get(snapshot_id)) == PENDING]
+
+    def transition(self, snapshot_id, from_status, to_status, encrypted_snapshot_id=None, error=None):
+        if to_status not in TRANSITIONS[from_status]:
+            raise ValueError(f"Invalid snapshot job transition {from_status} -> {to_status} for {snapshot_id}")
+        self._buffer.append((to_status, encrypted_snapshot_id, error, time.time(), snapshot_id, from_status))
+        self._buffered_status[snapshot_id] = to_status
+        if len(self._buffer) >= FLUSH_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with self.conn:
+            self.conn.executemany('''
+                UPDATE snapshot_jobs
+                SET status = ?, encrypted_snapshot_id = COALESCE(?, encrypted_snapshot_id), error = ?, updated_at = ?
+                WHERE snapshot_id = ? AND status = ?
+            ''', self._buffer)
+        self._buffer = []
+        self._buffered_status = {}
+
+    async def flush_periodically(self, interval=FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def status(self, snapshot_id):
+        status = self._buffered_status.get(snapshot_id)
+        if status is None:
+            row = self.conn.execute('SELECT status FROM snapshot_jobs WHERE snapshot_id = ?', (snapshot_id,)).fetchone()
+            status = row[0] if row else None
+        return status
+
+    def jobs(self, status):
+        # (snapshot_id, encrypted_snapshot_id) of every job in the given state
+        self.flush()
+        return self.conn.execute(
+            'SELECT snapshot_id, encrypted_snapshot_id FROM snapshot_jobs WHERE status = ?', (status,)
+        ).fetchall()
+
+    def iter_jobs(self, status, batch_size=JOB_BATCH_SIZE):
+        # Same as jobs, read batch_size rows at a time in snapshot_id order instead of all at once;
+        # each batch starts after the last ID read, so jobs changing state in between are not skipped
+        last_id = ''
+        while True:
+            self.flush()
+            rows = self.conn.execute(
+                'SELECT snapshot_id, encrypted_snapshot_id FROM snapshot_jobs WHERE status = ? AND snapshot_id > ? '
+                'ORDER BY snapshot_id LIMIT ?', (status, last_id, batch_size)
+            ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def counts(self):
+        self.flush()
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM snapshot_jobs GROUP BY status').fetchall())
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+
+def _import_legacy_rows(conn):
+    # Carry over rows from the old unkeyed 'snapshots' table once
+    legacy = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='snapshots'").fetchone()
+    if legacy:
+        conn.execute('''
+            INSERT OR IGNORE INTO snapshot_jobs (snapshot_id, encrypted_snapshot_id, status, updated_at)
+            SELECT original_snapshot_id, encrypted_snapshot_id,
+                   CASE status WHEN 'available' THEN 'deleted' ELSE status END, ?
+            FROM snapshots
+        ''', (time.time(),))
+        conn.execute('DROP TABLE snapshots')
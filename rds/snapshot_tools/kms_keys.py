@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger('my_app')
+
+
+async def get_or_create_kms_key(backend, alias_name):
+    # Check if the key alias already exists
+    try:
+        response = await backend.call('kms', 'describe_key', KeyId=f'alias/{alias_name}')
+        key_id = response['KeyMetadata']['KeyId']
+        logger.info(f"KMS key with alias '{alias_name}' already exists with KeyId: {key_id}")
+        return key_id
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NotFoundException':
+            raise
+        # If the key alias does not exist, create a new key
+        key_description = 'Default master key that protects my RDS database volumes when no other key is defined'
+        key_response = await backend.call(
+            'kms', 'create_key',
+            Description=key_description,
+            Origin='AWS_KMS',  # AWS managed key
+            KeyUsage='ENCRYPT_DECRYPT',
+            BypassPolicyLockoutSafetyCheck=False
+        )
+        key_id = key_response['KeyMetadata']['KeyId']
+        # Create an alias for the new key
+        await backend.call(
+            'kms', 'create_alias',
+            AliasName=f'alias/{alias_name}',
+            TargetKeyId=key_id
+        )
+        logger.info(f"Created new KMS key with alias '{alias_name}' and KeyId: {key_id}")
+        return key_id
+
+
+class KmsKeyCache:
+    """KMS key IDs by region and alias, each resolved once per run.
+
+    ``resolve(backend, alias)`` looks a key up in the backend's region;
+    concurrent lookups of the same key share one call.
+    """
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+        self._keys = {}
+
+    async def key_id(self, backend, alias):
+        key = (await backend.region(), alias)
+        future = self._keys.get(key)
+        if future is None:
+            future = self._keys[key] = asyncio.ensure_future(self.resolve(backend, alias))
+        try:
+            return await future
+        except Exception:
+            # Let the next caller try again
+            self._keys.pop(key, None)
+            raise
@@ -0,0 +1,98 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'my_app'
+# Records below this level are dropped before any formatting happens
+DEFAULT_LOG_LEVEL = os.environ.get('SNAPSHOT_TOOLS_LOG_LEVEL', 'INFO').upper()
+# 'text' for the classic one-line format, 'json' for one JSON object per line
+DEFAULT_LOG_FORMAT = os.environ.get('SNAPSHOT_TOOLS_LOG_FORMAT', 'text')
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# LogRecord attributes that are not structured fields passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+SNAPSHOT_DEBUG_FORMAT = ('DBSnapshotIdentifier: %s, Status: %s, DBInstanceIdentifier: %s, SnapshotType: %s, '
+                         'Engine: %s, SnapshotCreateTime: %s , Encrypted: %s')
+SNAPSHOT_FIELDS = ('DBSnapshotIdentifier', 'Status', 'DBInstanceIdentifier', 'SnapshotType', 'Engine',
+                   'SnapshotCreateTime', 'Encrypted')
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with fields passed as ``extra`` kept structured."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records as they are, the listener thread does all the formatting.
+
+    The stock ``QueueHandler`` merges the message and arguments in the
+    calling thread; the tools only log immutable arguments, so that work can
+    move to the writer thread as well.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks hold frames that must not outlive the calling thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def debug_snapshot(logger, snapshot):
+    # Per-snapshot debug record, nothing is built unless debug output is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        values = [snapshot.get(field) for field in SNAPSHOT_FIELDS]
+        logger.debug(SNAPSHOT_DEBUG_FORMAT, *values, extra={'snapshot': dict(zip(SNAPSHOT_FIELDS, values))})
+
+
+def setup_logging(log_file, level=DEFAULT_LOG_LEVEL, log_format=DEFAULT_LOG_FORMAT, stream=None):
+    # Send the 'my_app' records through a queue to a console and a file handler on a background thread
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    stop_logging()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stderr), logging.FileHandler(log_file)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(records))
+    _listener = QueueListener(records, *handlers)
+    _listener.start()
+    return logger
+
+
+@atexit.register
+def stop_logging():
+    # Write out the queued records and close the handlers
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
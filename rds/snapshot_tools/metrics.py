@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from .rate_limiter import buckets, is_throttling_error
+
+logger = logging.getLogger('my_app')
+
+# File the metrics are written to, '.json' for JSON and anything else for the Prometheus text format;
+# metrics are only written when a path is set
+DEFAULT_METRICS_PATH = os.environ.get('SNAPSHOT_TOOLS_METRICS_PATH', '')
+# Seconds between metric dumps during a run
+DEFAULT_DUMP_INTERVAL = float(os.environ.get('SNAPSHOT_TOOLS_METRICS_INTERVAL', '60'))
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    type_name = 'untyped'
+
+    def __init__(self, registry, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = registry.lock
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label_name, '')) for label_name in self.label_names)
+
+    def samples(self):
+        with self._lock:
+            return [(dict(zip(self.label_names, key)), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # For collectors copying a total that is counted elsewhere
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, registry, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [bucket_count + (value <= bound) for bucket_count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered as Prometheus text or JSON.
+
+    Collectors are called before every rendering to refresh gauges whose
+    values are cheaper to read on demand, such as job counts per state.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Counter(self, name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._add(Gauge(self, name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help_text, label_names, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _collect(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.info(f"ERROR: Metrics collector {collector} failed: {e}")
+
+    def to_prometheus(self):
+        self._collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for labels, value in metric.samples():
+                if isinstance(metric, Histogram):
+                    counts, total, count = value
+                    for bound, bucket_count in zip(metric.buckets, counts):
+                        lines.append(f'{metric.name}_bucket{_labels(labels, le=bound)} {bucket_count}')
+                    lines.append(f'{metric.name}_bucket{_labels(labels, le="+Inf")} {count}')
+                    lines.append(f'{metric.name}_sum{_labels(labels)} {total}')
+                    lines.append(f'{metric.name}_count{_labels(labels)} {count}')
+                else:
+                    lines.append(f'{metric.name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        self._collect()
+        metrics = {}
+        for metric in self.metrics.values():
+            samples = []
+            for labels, value in metric.samples():
+                if isinstance(metric, Histogram):
+                    counts, total, count = value
+                    samples.append({'labels': labels, 'buckets': dict(zip(map(str, metric.buckets), counts)),
+                                    'sum': total, 'count': count})
+                else:
+                    samples.append({'labels': labels, 'value': value})
+            metrics[metric.name] = {'type': metric.type_name, 'help': metric.help_text, 'samples': samples}
+        return json.dumps({'timestamp': time.time(), 'metrics': metrics}, indent=2)
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+REGISTRY = MetricsRegistry()
+
+api_calls = REGISTRY.counter('aws_api_calls_total', 'AWS API calls by final outcome.', ('service', 'operation', 'outcome'))
+api_attempts = REGISTRY.counter('aws_api_attempts_total', 'HTTP attempts sent, retries included.', ('service', 'operation'))
+api_retries = REGISTRY.counter('aws_api_retries_total', 'Attempts retried by botocore.', ('service', 'operation'))
+api_throttles = REGISTRY.counter('aws_api_throttles_total', 'Attempts answered with a throttling error.', ('service', 'operation'))
+api_latency = REGISTRY.histogram('aws_api_call_seconds', 'Duration of AWS API calls, retries included.', ('service', 'operation'))
+api_in_flight = REGISTRY.gauge('aws_api_calls_in_flight', 'AWS API calls currently running.', ('service', 'operation'))
+rate_limit_wait = REGISTRY.counter('aws_rate_limit_wait_seconds_total', 'Seconds attempts waited for the rate limiter.', ('scope', 'family'))
+rate_limit_rate = REGISTRY.gauge('aws_rate_limit_requests_per_second', 'Current adaptive rate of each API family.', ('scope', 'family'))
+copies_in_flight = REGISTRY.gauge('snapshot_copies_in_flight', 'Snapshot copies started and not yet finished.', ('stage',))
+copies_queued = REGISTRY.gauge('snapshot_copies_queued', 'Snapshot copies requeued after a quota error.', ('stage',))
+copies = REGISTRY.counter('snapshot_copies_total', 'Snapshot copies by result.', ('stage', 'result'))
+reclaimed_storage = REGISTRY.counter('snapshot_reclaimed_storage_gib_total', 'Allocated storage of deleted unencrypted snapshots.', ('kind',))
+snapshot_jobs = REGISTRY.gauge('snapshot_jobs', 'Snapshot jobs per state.', ('state',))
+
+
+def _collect_rate_limits():
+    for (scope, family), bucket in buckets():
+        rate_limit_wait.set(bucket.waited, scope=scope, family=family)
+        rate_limit_rate.set(bucket.rate, scope=scope, family=family)
+
+
+REGISTRY.add_collector(_collect_rate_limits)
+
+
+def _before_call(event_name, context=None, **kwargs):
+    _, service_name, operation_name = event_name.split('.', 2)
+    if context is not None:
+        context['metrics_started'] = time.monotonic()
+    api_in_flight.inc(service=service_name, operation=operation_name)
+
+
+def _finish_call(event_name, context, outcome, retries=0):
+    _, service_name, operation_name = event_name.split('.', 2)
+    api_in_flight.dec(service=service_name, operation=operation_name)
+    api_calls.inc(service=service_name, operation=operation_name, outcome=outcome)
+    if retries:
+        api_retries.inc(retries, service=service_name, operation=operation_name)
+    started = (context or {}).get('metrics_started')
+    if started is not None:
+        api_latency.observe(time.monotonic() - started, service=service_name, operation=operation_name)
+
+
+def _after_call(event_name, parsed=None, context=None, **kwargs):
+    parsed = parsed or {}
+    outcome = parsed.get('Error', {}).get('Code', 'ok')
+    _finish_call(event_name, context, outcome, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+
+def _after_call_error(event_name, exception=None, context=None, **kwargs):
+    _finish_call(event_name, context, type(exception).__name__)
+
+
+def _before_send(event_name, **kwargs):
+    _, service_name, operation_name = event_name.split('.', 2)
+    api_attempts.inc(service=service_name, operation=operation_name)
+
+
+def _needs_retry(event_name, response=None, **kwargs):
+    if response is not None and is_throttling_error((response[1] or {}).get('Error', {}).get('Code')):
+        _, service_name, operation_name = event_name.split('.', 2)
+        api_throttles.inc(service=service_name, operation=operation_name)
+
+
+def register_metrics(client):
+    # Record every call of a boto3 or aiobotocore client, the handlers never block
+    service_name = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f'before-call.{service_name}', _before_call)
+    client.meta.events.register(f'after-call.{service_name}', _after_call)
+    client.meta.events.register(f'after-call-error.{service_name}', _after_call_error)
+    client.meta.events.register(f'before-send.{service_name}', _before_send)
+    client.meta.events.register(f'needs-retry.{service_name}', _needs_retry)
+    return client
+
+
+def write_metrics(path=DEFAULT_METRICS_PATH):
+    # Replace the metrics file in one step so readers never see a partial dump
+    if not path:
+        return
+    content = REGISTRY.to_json() if path.endswith('.json') else REGISTRY.to_prometheus()
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as metrics_file:
+        metrics_file.write(content)
+    os.replace(temporary_path, path)
+
+
+async def dump_periodically(path=DEFAULT_METRICS_PATH, interval=DEFAULT_DUMP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        write_metrics(path)
+
+
+@asynccontextmanager
+async def metrics_dumping(path=DEFAULT_METRICS_PATH, interval=DEFAULT_DUMP_INTERVAL):
+    # Dump the metrics every interval seconds while the block runs and once more at its end
+    if not path:
+        yield
+        return
+    dumper = asyncio.create_task(dump_periodically(path, interval))
+    try:
+        yield
+    finally:
+        dumper.cancel()
+        write_metrics(path)
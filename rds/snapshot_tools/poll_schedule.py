@@ -0,0 +1,76 @@
+import random
+import time
+from datetime import datetime, timezone
+
+# Bounds for the delay between two status checks of the same snapshot (seconds)
+MIN_POLL_INTERVAL = 15
+MAX_POLL_INTERVAL = 900
+# Delay used while there is no progress information yet
+DEFAULT_POLL_INTERVAL = 60
+# Fraction of the estimated remaining time to wait before the next check
+REMAINING_TIME_FRACTION = 0.5
+# Relative random spread added to every delay so checks do not line up
+JITTER = 0.2
+
+
+def _with_jitter(delay, min_interval, max_interval):
+    delay *= random.uniform(1 - JITTER, 1 + JITTER)
+    return max(min_interval, min(max_interval, delay))
+
+
+class AdaptivePollSchedule:
+    """Decide when each in-progress snapshot should be checked again.
+
+    The remaining copy time is estimated from ``PercentProgress`` and either
+    the progress rate seen between two checks or, on the first check, the
+    time since ``SnapshotCreateTime``. The next check is scheduled part of the
+    way towards the estimated finish, so large copies back off while copies
+    that are nearly done are checked again soon. ``first_check_delay`` holds
+    back the first check of a new copy, for when something else reports it.
+    """
+
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, first_check_delay=0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.first_check_delay = first_check_delay
+        self._observations = {}
+
+    def estimate_remaining(self, snapshot, now=None):
+        # Seconds until the snapshot is expected to finish, or None if unknown
+        now = time.time() if now is None else now
+        identifier = _observation_key(snapshot)
+        progress = snapshot.get('PercentProgress') or 0
+        previous = self._observations.get(identifier)
+        self._observations[identifier] = (now, progress)
+        if progress >= 100:
+            return 0
+        if previous is not None and progress > previous[1]:
+            rate = (progress - previous[1]) / (now - previous[0])
+            return (100 - progress) / rate
+        create_time = snapshot.get('SnapshotCreateTime')
+        if progress > 0 and isinstance(create_time, datetime):
+            if create_time.tzinfo is None:
+                create_time = create_time.replace(tzinfo=timezone.utc)
+            elapsed = now - create_time.timestamp()
+            if elapsed > 0:
+                return elapsed * (100 - progress) / progress
+        return None
+
+    def next_delay(self, snapshot, now=None):
+        remaining = self.estimate_remaining(snapshot, now)
+        if remaining is None:
+            delay = DEFAULT_POLL_INTERVAL
+        else:
+            delay = remaining * REMAINING_TIME_FRACTION
+        return _with_jitter(delay, self.min_interval, self.max_interval)
+
+    def forget(self, snapshot_identifier, identifier_key='DBSnapshotIdentifier'):
+        self._observations.pop((identifier_key, snapshot_identifier), None)
+
+
+def _observation_key(snapshot):
+    # DB and cluster snapshots may share a name, so the identifier field is part of the key
+    for identifier_key in ('DBSnapshotIdentifier', 'DBClusterSnapshotIdentifier'):
+        if identifier_key in snapshot:
+            return identifier_key, snapshot[identifier_key]
+    return None
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import re
+import threading
+import time
+
+# Services whose calls go through the limiter
+LIMITED_SERVICES = ('rds', 'kms', 'cloudfront')
+# Requests per second each API family starts at, before any adaptation
+INITIAL_RATE = float(os.environ.get('SNAPSHOT_TOOLS_INITIAL_RATE', '10'))
+MIN_RATE = 0.5
+MAX_RATE = float(os.environ.get('SNAPSHOT_TOOLS_MAX_RATE', '100'))
+# Requests per second added for every second of unthrottled traffic
+ADDITIVE_INCREASE = 1.0
+# Factor the rate is multiplied by on throttling
+MULTIPLICATIVE_DECREASE = 0.5
+# Throttles within this many seconds of a decrease count as the same congestion event
+DECREASE_COOLDOWN = 1.0
+THROTTLING_ERROR_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+)
+
+_VERB = re.compile(r'[A-Z][a-z]+|[a-z]+')
+
+
+class AdaptiveTokenBucket:
+    """Token bucket whose refill rate adapts to throttling (AIMD).
+
+    Each successful request raises the rate so that it grows by
+    ``ADDITIVE_INCREASE`` per second of unthrottled traffic; a throttling
+    response multiplies it by ``MULTIPLICATIVE_DECREASE``, at most once per
+    ``DECREASE_COOLDOWN``. The bucket holds up to one second of tokens.
+    Callers reserve a token and wait the returned delay, so threads and
+    coroutines share one bucket without polling.
+    """
+
+    def __init__(self, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = min(1.0, rate)
+        self._updated = time.monotonic()
+        self._decreased = 0.0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Take a token, possibly one that is only refilled later, and return the seconds to wait for it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            self.waited += delay
+            return delay
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased >= DECREASE_COOLDOWN:
+                self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+                self._decreased = now
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def api_family(service_name, operation_name):
+    # 'rds', 'DescribeDBSnapshots' or 'describe_db_snapshots' -> 'rds:describe'
+    return f'{service_name}:{_VERB.match(operation_name).group().lower()}'
+
+
+def get_bucket(scope, family):
+    # Process-wide bucket of an API family in a scope (profile and region, which RDS limits separately),
+    # shared by every client, thread and coroutine
+    key = (scope, family)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(key, AdaptiveTokenBucket())
+    return bucket
+
+
+def buckets():
+    # (scope, family) and bucket of every API family used so far
+    with _buckets_lock:
+        return list(_buckets.items())
+
+
+def is_throttling_error(code):
+    return code in THROTTLING_ERROR_CODES
+
+
+def record_response(bucket, parsed_response):
+    code = (parsed_response or {}).get('Error', {}).get('Code')
+    if is_throttling_error(code):
+        bucket.on_throttle()
+    elif code is None:
+        bucket.on_success()
+
+
+def _event_bucket(scope, event_name):
+    # 'before-send.rds.DescribeDBSnapshots' -> bucket of 'rds:describe'
+    _, service_name, operation_name = event_name.split('.', 2)
+    return get_bucket(scope, api_family(service_name, operation_name))
+
+
+def _client_scope(client, profile_name):
+    return f"{profile_name or 'default'}/{client.meta.region_name}"
+
+
+def client_bucket(client, operation_name, profile_name=None):
+    # Bucket a call of the client is limited by, None for services the limiter leaves alone
+    service_name = client.meta.service_model.service_name
+    if service_name not in LIMITED_SERVICES:
+        return None
+    return get_bucket(_client_scope(client, profile_name), api_family(service_name, operation_name))
+
+
+def register_rate_limits(client, profile_name=None, wait=True):
+    # Throttle every attempt of a boto3 client, retries included, and adapt to its responses. With wait=False
+    # the client only records its responses, for callers that wait for a token themselves before the call,
+    # such as the executor backend, which waits on the event loop instead of holding a worker thread
+    service_name = client.meta.service_model.service_name
+    if service_name not in LIMITED_SERVICES:
+        return client
+    scope = _client_scope(client, profile_name)
+
+    def before_send(event_name, **kwargs):
+        _event_bucket(scope, event_name).acquire()
+
+    def needs_retry(event_name, response=None, **kwargs):
+        if response is not None:
+            record_response(_event_bucket(scope, event_name), response[1])
+
+    if wait:
+        client.meta.events.register(f'before-send.{service_name}', before_send)
+    client.meta.events.register(f'needs-retry.{service_name}', needs_retry)
+    return client
+
+
+def register_rate_limits_async(client, profile_name=None):
+    # Same for an aiobotocore client, whose event hooks are awaited on the event loop
+    service_name = client.meta.service_model.service_name
+    if service_name not in LIMITED_SERVICES:
+        return client
+    scope = _client_scope(client, profile_name)
+
+    async def before_send(event_name, **kwargs):
+        await _event_bucket(scope, event_name).acquire_async()
+
+    async def needs_retry(event_name, response=None, **kwargs):
+        if response is not None:
+            record_response(_event_bucket(scope, event_name), response[1])
+
+    client.meta.events.register(f'before-send.{service_name}', before_send)
+    client.meta.events.register(f'needs-retry.{service_name}', needs_retry)
+    return client
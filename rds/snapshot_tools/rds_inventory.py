@@ -0,0 +1,43 @@
+def collect_db_instances(rds_client):
+    instances = []
+    paginator = rds_client.get_paginator('describe_db_instances')
+    for page in paginator.paginate():
+        instances.extend(page['DBInstances'])
+    return instances
+
+
+def collect_db_clusters(rds_client):
+    clusters = []
+    paginator = rds_client.get_paginator('describe_db_clusters')
+    for page in paginator.paginate():
+        clusters.extend(page['DBClusters'])
+    return clusters
+
+
+class RdsInventory:
+    """DB instances and clusters of one account and region, fetched once.
+
+    Reports are filters or projections over the collected records, so
+    adding a report costs no extra API calls.
+    """
+
+    def __init__(self, instances, clusters, profile=None, region=None):
+        self.instances = instances
+        self.clusters = clusters
+        self.profile = profile
+        self.region = region
+
+    @classmethod
+    def collect(cls, rds_client, profile=None, region=None):
+        # One paginated pass over describe_db_instances and one over describe_db_clusters
+        return cls(collect_db_instances(rds_client), collect_db_clusters(rds_client), profile, region)
+
+    def instances_where(self, predicate):
+        return [instance for instance in self.instances if predicate(instance)]
+
+    def clusters_where(self, predicate):
+        return [cluster for cluster in self.clusters if predicate(cluster)]
+
+    def project(self, records, *fields):
+        # Keep only the given fields of each record, as the reports print them
+        return [{field: record[field] for field in fields} for record in records]
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from .copy_policies import FifoPolicy
+from .copy_scheduler import MAX_CONCURRENT_COPIES, CopyScheduler, get_manual_snapshot_quota
+from .snapshot_engine import copy_encrypted_snapshot, copy_snapshot_to_region, delete_when_encrypted
+
+logger = logging.getLogger('my_app')
+
+
+class CrossRegionPipeline:
+    """Encrypt snapshots in their region and copy the encrypted copies to a second region.
+
+    Two ``CopyScheduler`` stages run side by side, each with its own
+    in-flight limit and snapshot quota: as soon as an encrypted copy is
+    available it is handed to the cross-region stage, while its original is
+    deleted and the next encryption starts. Each stage waits on a poller of
+    its own region. ``copy_encrypted`` and ``delete_original`` replace the
+    encrypt stage's copy and delete steps, with the signatures of
+    ``copy_encrypted_snapshot`` and ``delete_when_encrypted``.
+    """
+
+    def __init__(self, source_backend, target_backend, key_cache, key_alias, source_poller, target_poller,
+                 max_in_flight=MAX_CONCURRENT_COPIES, target_max_in_flight=MAX_CONCURRENT_COPIES, policy=None,
+                 copy_encrypted=copy_encrypted_snapshot, delete_original=delete_when_encrypted):
+        self.source_backend = source_backend
+        self.target_backend = target_backend
+        self.key_cache = key_cache
+        self.key_alias = key_alias
+        self.source_poller = source_poller
+        self.target_poller = target_poller
+        self.max_in_flight = max_in_flight
+        self.target_max_in_flight = target_max_in_flight
+        self.policy = policy
+        self.copy_encrypted = copy_encrypted
+        self.delete_original = delete_original
+        self.encrypted = 0
+        self.replicated = 0
+
+    async def run(self, snapshots):
+        source_region = await self.source_backend.region()
+        target_region = await self.target_backend.region()
+        source_key_id, target_key_id = await asyncio.gather(
+            self.key_cache.key_id(self.source_backend, self.key_alias),
+            self.key_cache.key_id(self.target_backend, self.key_alias)
+        )
+        identity = await self.source_backend.call('sts', 'get_caller_identity')
+        partition = identity['Arn'].split(':')[1] if 'Arn' in identity else 'aws'
+        logger.info("Encrypting in %s with %s, copying to %s with %s", source_region, source_key_id, target_region, target_key_id)
+        handoff = asyncio.Queue()
+
+        def hand_off(snapshot, encrypted_identifier):
+            handoff.put_nowait(snapshot._replace(identifier=encrypted_identifier, status='available', progress=100, encrypted=True))
+
+        async def copy_to_target(snapshot):
+            source_arn = snapshot.kind.arn(snapshot.identifier, source_region, identity['Account'], partition)
+            return await copy_snapshot_to_region(self.target_backend, snapshot, source_arn, source_region, target_key_id)
+
+        encrypt = CopyScheduler(
+            lambda snapshot: self.copy_encrypted(self.source_backend, snapshot, source_key_id),
+            lambda snapshot, encrypted_identifier: self.delete_original(snapshot, encrypted_identifier, self.source_poller, hand_off),
+            max_in_flight=self.max_in_flight,
+            snapshot_quota=await get_manual_snapshot_quota(self.source_backend),
+            policy=self.policy
+        )
+        # Copies are started in the order they were encrypted, as soon as each one is handed over
+        replicate = CopyScheduler(
+            copy_to_target,
+            self.wait_for_replica,
+            max_in_flight=self.target_max_in_flight,
+            snapshot_quota=await get_manual_snapshot_quota(self.target_backend),
+            policy=FifoPolicy(),
+            lookahead=1,
+            stage='replicate'
+        )
+
+        async def run_encrypt():
+            try:
+                await encrypt.run(snapshots)
+            finally:
+                handoff.put_nowait(None)
+
+        # A stage that fails cancels the other one, whose scheduler then stops its copies in flight
+        try:
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(run_encrypt())
+                stages.create_task(replicate.run(_drain(handoff)))
+        except ExceptionGroup as errors:
+            # Raise the error of the failed stage itself, as long as only one failed
+            if len(errors.exceptions) == 1:
+                raise errors.exceptions[0] from None
+            raise
+        self.encrypted = encrypt.completed
+        self.replicated = replicate.completed
+
+    async def wait_for_replica(self, snapshot, replica_identifier):
+        status = await self.target_poller.wait_for_status(replica_identifier, kind=snapshot.kind)
+        if status == 'available':
+            logger.debug("Copied %s to %s", snapshot, await self.target_backend.region())
+        else:
+            logger.info("ERROR: Copy of %s in %s ended in state %s", snapshot, await self.target_backend.region(), status)
+
+
+async def _drain(queue):
+    # Items put on the queue until the None that ends it
+    while (item := await queue.get()) is not None:
+        yield item
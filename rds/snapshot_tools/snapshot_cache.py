@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from .snapshot_poller import describe_db_snapshot_statuses
+from .snapshot_stream import batched, stream_db_snapshots
+
+logger = logging.getLogger('my_app')
+
+DEFAULT_CACHE_PATH = os.environ.get('SNAPSHOT_CACHE_PATH', 'snapshot_cache.db')
+# Seconds a cached inventory is served from disk without asking RDS
+DEFAULT_CACHE_TTL = int(os.environ.get('SNAPSHOT_CACHE_TTL', '600'))
+# Force a full listing instead of an incremental refresh
+FULL_RESYNC = os.environ.get('SNAPSHOT_CACHE_FULL_RESYNC') == '1'
+# RDS keeps events for 14 days, older caches need a full listing
+EVENT_RETENTION = timedelta(days=13)
+# Events are read from a little before the watermark to cover clock skew
+WATERMARK_MARGIN = timedelta(minutes=5)
+# Cached snapshots not in one of these states are described again on every refresh
+SETTLED_STATUSES = ('available', 'failed')
+
+
+def _encode(snapshot):
+    return json.dumps(snapshot, default=lambda value: value.isoformat())
+
+
+def copy_record(identifier):
+    # What is known of an encrypted copy that was just started, until a refresh describes it
+    return {'DBSnapshotIdentifier': identifier, 'Status': 'creating', 'SnapshotType': 'manual', 'Encrypted': True}
+
+
+def _decode(record):
+    snapshot = json.loads(record)
+    for field in ('SnapshotCreateTime', 'InstanceCreateTime', 'OriginalSnapshotCreateTime'):
+        if field in snapshot:
+            snapshot[field] = datetime.fromisoformat(snapshot[field])
+    return snapshot
+
+
+class SnapshotInventoryCache:
+    """On-disk cache of the manual DB snapshots of each account and region.
+
+    Within the TTL the inventory is served from disk. After that it is
+    refreshed incrementally: ``describe_db_snapshots`` cannot filter by time,
+    so the snapshots created, copied or deleted since the watermark (the last
+    refresh time) are taken from ``describe_events``. They are described
+    again together with every cached snapshot that has not settled yet. A
+    full listing is done on the first run, when the watermark is older than
+    the event retention, or when a full resync is requested.
+
+    Tools that create or delete snapshots record them with ``upsert`` and
+    ``mark_deleted``, so a rerun within the TTL does not serve snapshots
+    they already deleted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._scopes = {}
+
+    @property
+    def conn(self):
+        # The database is opened on first use, so creating a cache does no I/O
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cached_snapshots (
+                    account TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    snapshot_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (account, region, snapshot_id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_state (
+                    account TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    refreshed_at REAL NOT NULL,
+                    PRIMARY KEY (account, region)
+                )
+            ''')
+        return conn
+
+    def _refreshed_at(self, account, region):
+        row = self.conn.execute(
+            'SELECT refreshed_at FROM cache_state WHERE account = ? AND region = ?', (account, region)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, account, region, snapshots, removed_ids=(), refreshed_at=None):
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM cached_snapshots WHERE account = ? AND region = ? AND snapshot_id = ?',
+                ((account, region, snapshot_id) for snapshot_id in removed_ids)
+            )
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO cached_snapshots VALUES (?, ?, ?, ?, ?)',
+                ((account, region, snapshot['DBSnapshotIdentifier'], snapshot['Status'], _encode(snapshot))
+                 for snapshot in snapshots)
+            )
+            if refreshed_at is not None:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO cache_state VALUES (?, ?, ?)', (account, region, refreshed_at)
+                )
+
+    async def _full_listing(self, backend, account, region, started_at):
+        # Yield each page as it arrives, the state row is only written once the listing is complete
+        with self.conn:
+            self.conn.execute('DELETE FROM cache_state WHERE account = ? AND region = ?', (account, region))
+            self.conn.execute('DELETE FROM cached_snapshots WHERE account = ? AND region = ?', (account, region))
+        count = 0
+        async for page in batched(stream_db_snapshots(backend, SnapshotType='manual')):
+            self._store(account, region, page)
+            count += len(page)
+            for snapshot in page:
+                yield snapshot
+        self._store(account, region, [], refreshed_at=started_at)
+        logger.info(f"Cached {count} manual snapshots of {account}/{region} from a full listing")
+
+    async def _incremental_refresh(self, backend, account, region, refreshed_at, started_at):
+        since = datetime.fromtimestamp(refreshed_at, timezone.utc) - WATERMARK_MARGIN
+        changed_ids = set()
+        async for page in backend.paginate('rds', 'describe_events', SourceType='db-snapshot', StartTime=since):
+            for event in page['Events']:
+                changed_ids.add(event['SourceIdentifier'])
+        placeholders = ', '.join('?' for _ in SETTLED_STATUSES)
+        changed_ids.update(row[0] for row in self.conn.execute(
+            f'SELECT snapshot_id FROM cached_snapshots WHERE account = ? AND region = ? AND status NOT IN ({placeholders})',
+            (account, region, *SETTLED_STATUSES)
+        ))
+        snapshots = await describe_db_snapshot_statuses(backend, changed_ids)
+        manual = [snapshot for snapshot in snapshots.values() if snapshot['SnapshotType'] == 'manual']
+        removed_ids = changed_ids - {snapshot['DBSnapshotIdentifier'] for snapshot in manual}
+        self._store(account, region, manual, removed_ids, refreshed_at=started_at)
+        logger.info(f"Refreshed {len(changed_ids)} changed snapshots of {account}/{region}, {len(removed_ids)} removed")
+
+    async def _scope(self, backend):
+        # Account and region of a backend, looked up once
+        scope = self._scopes.get(backend)
+        if scope is None:
+            identity = await backend.call('sts', 'get_caller_identity')
+            scope = self._scopes[backend] = (identity['Account'], await backend.region())
+        return scope
+
+    async def upsert(self, backend, snapshot):
+        # Record a manual DB snapshot the caller created or changed; until its status settles it is
+        # described again at every refresh, so a partial record such as a started copy is completed then
+        account, region = await self._scope(backend)
+        self._store(account, region, [snapshot])
+
+    async def mark_deleted(self, backend, snapshot_id):
+        account, region = await self._scope(backend)
+        self._store(account, region, [], [snapshot_id])
+
+    async def iter_db_snapshots(self, backend, full_resync=FULL_RESYNC):
+        # Yield all manual DB snapshots of the backend's account and region, refreshed as needed
+        account, region = await self._scope(backend)
+        started_at = time.time()
+        refreshed_at = self._refreshed_at(account, region)
+        if full_resync or refreshed_at is None or started_at - refreshed_at > EVENT_RETENTION.total_seconds():
+            async for snapshot in self._full_listing(backend, account, region, started_at):
+                yield snapshot
+            return
+        if started_at - refreshed_at > self.ttl:
+            await self._incremental_refresh(backend, account, region, refreshed_at, started_at)
+        else:
+            logger.info(f"Serving snapshots of {account}/{region} from the cache refreshed {started_at - refreshed_at:.0f}s ago")
+        for row in self.conn.execute(
+            'SELECT record FROM cached_snapshots WHERE account = ? AND region = ?', (account, region)
+        ):
+            yield _decode(row[0])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,110 @@
+import logging
+from botocore.exceptions import ClientError
+from .copy_scheduler import CopyQuotaExceeded
+from .metrics import reclaimed_storage
+from .snapshot_stream import stream_snapshot_refs
+
+logger = logging.getLogger('my_app')
+
+# Appended to a snapshot identifier to name its encrypted copy
+ENCRYPTED_SUFFIX = 'encrypted'
+
+
+async def stream_unencrypted_snapshots(backend, kind):
+    # Manual unencrypted snapshots of one kind, page by page
+    async for snapshot in stream_snapshot_refs(backend, kind, lambda snapshot: not snapshot.get(kind.encrypted_key),
+                                               SnapshotType='manual'):
+        yield snapshot
+
+
+async def merge_streams(*sources):
+    # Take one item from each source in turn, so no kind of snapshot waits for another to be listed
+    sources = [aiter(source) for source in sources]
+    while sources:
+        for source in list(sources):
+            try:
+                yield await anext(source)
+            except StopAsyncIteration:
+                sources.remove(source)
+
+
+async def copy_encrypted_snapshot(backend, snapshot, kms_key_id, copy_tags=False):
+    # Start an encrypted copy, returns its identifier or None if it could not be started
+    if not snapshot.kind.encrypts_on_copy:
+        logger.info("ERROR: The %s %s cannot be encrypted by copying it, restore it to a cluster with storage encryption "
+                    "and snapshot that cluster instead.", snapshot.kind.label, snapshot.identifier)
+        return None
+    target_identifier = f"{snapshot.identifier}-{ENCRYPTED_SUFFIX}"
+    return await _start_copy(backend, snapshot, snapshot.identifier, target_identifier, kms_key_id, copy_tags)
+
+
+async def copy_snapshot_to_region(backend, snapshot, source_arn, source_region, kms_key_id, copy_tags=False):
+    # Copy a snapshot from source_region into the backend's region under the same name,
+    # botocore signs the request the source region needs from SourceRegion
+    return await _start_copy(backend, snapshot, source_arn, snapshot.identifier, kms_key_id, copy_tags, SourceRegion=source_region)
+
+
+async def _start_copy(backend, snapshot, source, target_identifier, kms_key_id, copy_tags, **extra_parameters):
+    kind = snapshot.kind
+    parameters = {kind.source_parameter: source, kind.target_parameter: target_identifier, 'KmsKeyId': kms_key_id, **extra_parameters}
+    if copy_tags:
+        parameters['CopyTags'] = True
+    try:
+        response = await backend.call('rds', kind.copy_operation, **parameters)
+        encrypted_identifier = response[kind.response_key][kind.identifier_key]
+        logger.debug("Encrypted %s created: %s", kind.label, encrypted_identifier)
+        return encrypted_identifier
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in kind.already_exists_codes:
+            logger.info("ERROR: The %s %s for encryption already exists.", kind.label, target_identifier)
+            return target_identifier
+        elif error_code in kind.not_found_codes:
+            logger.info("ERROR: The specified %s %s for encryption could not be found.", kind.label, snapshot.identifier)
+        elif error_code in kind.invalid_state_codes:
+            logger.info("ERROR: The specified %s %s for encryption is in invalid state.", kind.label, snapshot.identifier)
+        elif error_code in ('SnapshotQuotaExceeded', 'SnapshotQuotaExceededFault'):
+            logger.info("ERROR: Snapshot Quota has been Exceeded, requeueing %s.", snapshot.identifier)
+            raise CopyQuotaExceeded(snapshot) from e
+        elif error_code in ('KMSKeyNotAccessible', 'KMSKeyNotAccessibleFault'):
+            logger.info("ERROR: KMS Key %s Not Accessible.", kms_key_id)
+        elif error_code == 'CustomAvailabilityZoneNotFound':
+            logger.info("ERROR: Custom Availability Zone Not Found.")
+        else:
+            logger.info("ERROR: For %s an unexpected error occurred: %s", snapshot.identifier, e)
+
+
+async def delete_snapshot(backend, snapshot):
+    # Delete a snapshot, returns False if it is still there afterwards
+    kind = snapshot.kind
+    try:
+        response = await backend.call('rds', kind.delete_operation, **{kind.identifier_key: snapshot.identifier})
+        logger.debug("Deleting %s: %s", kind.label, response[kind.response_key][kind.identifier_key])
+        return True
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in kind.invalid_state_codes:
+            logger.info("ERROR: The %s %s is not in a valid state for deletion.", kind.label, snapshot.identifier)
+        elif error_code in kind.not_found_codes:
+            logger.info("ERROR: The specified %s %s could not be found for deletion.", kind.label, snapshot.identifier)
+            return True
+        else:
+            logger.info("ERROR: For %s an unexpected error occurred: %s", snapshot.identifier, e)
+        return False
+
+
+async def delete_when_encrypted(snapshot, encrypted_identifier, poller, on_available=None):
+    # Wait for the shared poller to report the encrypted copy as finished, then delete the original;
+    # on_available(snapshot, encrypted_identifier) hands a finished copy on before that
+    logger.debug("Checking status of encrypted %s %s", snapshot.kind.label, encrypted_identifier)
+    status = await poller.wait_for_status(encrypted_identifier, kind=snapshot.kind)
+    if status == 'available':
+        if on_available is not None:
+            on_available(snapshot, encrypted_identifier)
+        logger.debug("Deleting unencrypted %s", snapshot)
+        deleted = await delete_snapshot(poller.backend, snapshot)
+        if deleted and snapshot.allocated_storage:
+            reclaimed_storage.inc(snapshot.allocated_storage, kind=snapshot.kind.name)
+        return deleted
+    logger.info("ERROR: Encrypted %s %s ended in state %s, keeping %s", snapshot.kind.label, encrypted_identifier, status, snapshot.identifier)
+    return False
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+from botocore.exceptions import BotoCoreError, ClientError
+from .poll_schedule import AdaptivePollSchedule, MAX_POLL_INTERVAL
+from .snapshot_kinds import CLUSTER_SNAPSHOT, DB_SNAPSHOT
+
+logger = logging.getLogger('my_app')
+
+# SQS queue receiving RDS snapshot events (through SNS or EventBridge); polling only when unset
+EVENTS_QUEUE_URL = os.environ.get('SNAPSHOT_EVENTS_QUEUE_URL')
+# With events, snapshots are still described this often in case an event was lost
+RECONCILE_INTERVAL = int(os.environ.get('SNAPSHOT_EVENTS_RECONCILE_INTERVAL', '300'))
+# Long polling wait of one receive_message call
+RECEIVE_WAIT_SECONDS = 20
+# Seconds to wait before receiving again after an error
+RECEIVE_RETRY_DELAY = 5
+
+# Event messages after which a copy needs no describe call to know its status
+_EVENT_STATUSES = (
+    (re.compile(r'\b(fail|failed|canceled|cancelled)\b', re.IGNORECASE), 'failed'),
+    (re.compile(r'^(finished|completed)\b.*\bcopy\b|\bsnapshot created\b', re.IGNORECASE), 'available'),
+)
+
+# 'Event Source' of RDS event notifications and 'SourceType' of EventBridge events
+_EVENT_KINDS = {
+    'db-snapshot': DB_SNAPSHOT,
+    'SNAPSHOT': DB_SNAPSHOT,
+    'db-cluster-snapshot': CLUSTER_SNAPSHOT,
+    'CLUSTER_SNAPSHOT': CLUSTER_SNAPSHOT,
+}
+
+
+async def sleep_until_notified(wakeup, timeout):
+    # Sleep up to timeout seconds, returns early once the event has been set and clears it
+    try:
+        await asyncio.wait_for(wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        return
+    wakeup.clear()
+
+
+def event_status(message):
+    # Snapshot status an event message implies, or None when only a describe call can tell
+    for pattern, status in _EVENT_STATUSES:
+        if pattern.search(message):
+            return status
+    return None
+
+
+def parse_snapshot_event(body):
+    # (kind, snapshot identifier, message) of an RDS snapshot event, or None for anything else
+    try:
+        event = json.loads(body) if isinstance(body, str) else body
+        if 'Message' in event and 'TopicArn' in event:
+            # SNS envelope without raw message delivery
+            event = json.loads(event['Message'])
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(event, dict):
+        return None
+    if 'detail' in event:
+        # EventBridge
+        detail = event['detail']
+        if not isinstance(detail, dict):
+            return None
+        kind = _EVENT_KINDS.get(detail.get('SourceType'))
+        identifier = detail.get('SourceIdentifier')
+        message = detail.get('Message', '')
+    else:
+        # RDS event notification published to SNS
+        kind = _EVENT_KINDS.get(event.get('Event Source'))
+        identifier = event.get('Source ID')
+        message = event.get('Event Message', '')
+    if kind is None or not identifier:
+        return None
+    return kind, identifier, message
+
+
+class SqsEventQueue:
+    """RDS snapshot events from an SQS queue, received with long polling."""
+
+    def __init__(self, backend, queue_url):
+        self.backend = backend
+        self.queue_url = queue_url
+
+    async def receive(self):
+        # Up to 10 (body, receipt handle) pairs, waits up to RECEIVE_WAIT_SECONDS for the first one
+        response = await self.backend.call(
+            'sqs', 'receive_message',
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=RECEIVE_WAIT_SECONDS
+        )
+        return [(message['Body'], message['ReceiptHandle']) for message in response.get('Messages', [])]
+
+    async def delete(self, receipt_handles):
+        if receipt_handles:
+            await self.backend.call(
+                'sqs', 'delete_message_batch',
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(number), 'ReceiptHandle': handle} for number, handle in enumerate(receipt_handles)]
+            )
+
+
+class LocalEventQueue:
+    """In-process stand-in for the SQS queue, to run and test the event mode offline."""
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+
+    def put(self, event):
+        self._queue.put_nowait(event)
+
+    async def receive(self):
+        messages = [(await self._queue.get(), None)]
+        while not self._queue.empty() and len(messages) < 10:
+            messages.append((self._queue.get_nowait(), None))
+        return messages
+
+    async def delete(self, receipt_handles):
+        pass
+
+
+def create_event_queue(backend, queue_url=EVENTS_QUEUE_URL):
+    # Queue of the event-driven mode, or None to rely on polling alone
+    return SqsEventQueue(backend, queue_url) if queue_url else None
+
+
+def reconcile_schedule(events):
+    # Poll schedule for the given event queue: the normal adaptive one without events, a slow sweep with them
+    if events is None:
+        return AdaptivePollSchedule()
+    return AdaptivePollSchedule(RECONCILE_INTERVAL, max(RECONCILE_INTERVAL, MAX_POLL_INTERVAL), first_check_delay=RECONCILE_INTERVAL)
+
+
+async def consume_snapshot_events(queue, notify):
+    # Call notify(kind, identifier, status) for every snapshot event, messages are deleted once handled
+    while True:
+        try:
+            messages = await queue.receive()
+        except (ClientError, BotoCoreError) as e:
+            # Connection errors and timeouts included, receiving is retried after a pause
+            logger.info("ERROR: Could not receive snapshot events: %s", e)
+            await asyncio.sleep(RECEIVE_RETRY_DELAY)
+            continue
+        for body, receipt_handle in messages:
+            # A message that cannot be handled is logged and deleted, it must not stop the consumer
+            try:
+                event = parse_snapshot_event(body)
+                if event is not None:
+                    kind, identifier, message = event
+                    logger.debug("Event for %s %s: %s", kind.label, identifier, message)
+                    notify(kind, identifier, event_status(message))
+            except Exception:
+                logger.exception("ERROR: Could not handle snapshot event %r", body)
+        try:
+            await queue.delete([receipt_handle for _, receipt_handle in messages if receipt_handle is not None])
+        except (ClientError, BotoCoreError) as e:
+            logger.info("ERROR: Could not delete handled snapshot events: %s", e)
+
+
+@asynccontextmanager
+async def snapshot_events(queue, notify):
+    # Consume events while the block runs, does nothing without a queue
+    if queue is None:
+        yield
+        return
+    logger.info(f"Waiting for snapshot events, reconciling by polling every {RECONCILE_INTERVAL}s")
+    consumer = asyncio.create_task(consume_snapshot_events(queue, notify))
+    try:
+        yield
+    finally:
+        consumer.cancel()
@@ -0,0 +1,93 @@
+import sys
+from collections import namedtuple
+
+
+class SnapshotKind:
+    """API names and fields of one kind of RDS snapshot.
+
+    DB instance snapshots and Aurora cluster snapshots go through the same
+    list, copy, describe and delete steps; only the operation, parameter,
+    response and error names differ. ``encrypts_on_copy`` is False where RDS
+    cannot encrypt an unencrypted snapshot by copying it: an unencrypted
+    cluster snapshot only yields an encrypted one by restoring it to a
+    cluster with storage encryption and snapshotting that cluster.
+    """
+
+    def __init__(self, name, label, describe_operation, list_key, identifier_key, source_key, filter_name, encrypted_key,
+                 copy_operation, source_parameter, target_parameter, response_key, delete_operation,
+                 not_found_codes, already_exists_codes, invalid_state_codes, arn_resource, encrypts_on_copy=True):
+        self.name = name
+        self.label = label
+        self.describe_operation = describe_operation
+        self.list_key = list_key
+        self.identifier_key = identifier_key
+        self.source_key = source_key
+        self.filter_name = filter_name
+        self.encrypted_key = encrypted_key
+        self.copy_operation = copy_operation
+        self.source_parameter = source_parameter
+        self.target_parameter = target_parameter
+        self.response_key = response_key
+        self.delete_operation = delete_operation
+        self.not_found_codes = not_found_codes
+        self.already_exists_codes = already_exists_codes
+        self.invalid_state_codes = invalid_state_codes
+        self.arn_resource = arn_resource
+        self.encrypts_on_copy = encrypts_on_copy
+
+    def __repr__(self):
+        return f'SnapshotKind({self.name!r})'
+
+    def ref(self, snapshot, identifier=None):
+        # Pipeline record of a described snapshot, with what the copy policies order by and its state when listed.
+        # Values shared by many snapshots are interned, so 100k records hold one copy of each engine and status.
+        return SnapshotRef(self, identifier or snapshot[self.identifier_key], _intern(snapshot.get(self.source_key)),
+                           snapshot.get('AllocatedStorage'), _intern(snapshot.get('Engine')),
+                           _intern(snapshot.get('Status')), snapshot.get('PercentProgress'), snapshot.get(self.encrypted_key))
+
+    def arn(self, identifier, region, account, partition='aws'):
+        # Cross-region copies name their source by ARN
+        return f'arn:{partition}:rds:{region}:{account}:{self.arn_resource}:{identifier}'
+
+
+DB_SNAPSHOT = SnapshotKind(
+    'db', 'DB snapshot', 'describe_db_snapshots', 'DBSnapshots', 'DBSnapshotIdentifier', 'DBInstanceIdentifier',
+    'db-snapshot-id', 'Encrypted',
+    'copy_db_snapshot', 'SourceDBSnapshotIdentifier', 'TargetDBSnapshotIdentifier', 'DBSnapshot', 'delete_db_snapshot',
+    not_found_codes=('DBSnapshotNotFound', 'DBSnapshotNotFoundFault'),
+    already_exists_codes=('DBSnapshotAlreadyExists', 'DBSnapshotAlreadyExistsFault'),
+    invalid_state_codes=('InvalidDBSnapshotState', 'InvalidDBSnapshotStateFault'),
+    arn_resource='snapshot',
+)
+CLUSTER_SNAPSHOT = SnapshotKind(
+    'cluster', 'DB cluster snapshot', 'describe_db_cluster_snapshots', 'DBClusterSnapshots', 'DBClusterSnapshotIdentifier',
+    'DBClusterIdentifier', 'db-cluster-snapshot-id', 'StorageEncrypted', 'copy_db_cluster_snapshot', 'SourceDBClusterSnapshotIdentifier',
+    'TargetDBClusterSnapshotIdentifier', 'DBClusterSnapshot', 'delete_db_cluster_snapshot',
+    not_found_codes=('DBClusterSnapshotNotFoundFault', 'DBClusterSnapshotNotFound'),
+    already_exists_codes=('DBClusterSnapshotAlreadyExistsFault', 'DBClusterSnapshotAlreadyExists'),
+    invalid_state_codes=('InvalidDBClusterSnapshotStateFault', 'InvalidDBClusterSnapshotState'),
+    arn_resource='cluster-snapshot',
+    encrypts_on_copy=False,
+)
+SNAPSHOT_KINDS = {kind.name: kind for kind in (DB_SNAPSHOT, CLUSTER_SNAPSHOT)}
+
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+
+class SnapshotRef(namedtuple('SnapshotRef', 'kind identifier source allocated_storage engine status progress encrypted',
+                             defaults=(None,) * 6)):
+    """A snapshot of either kind, as it moves through the pipeline.
+
+    ``source`` is the DB instance or cluster the snapshot was taken from,
+    ``allocated_storage`` its size in GiB and ``status``, ``progress`` and
+    ``encrypted`` its state, when known from the listing. Records are plain
+    tuples without a per-instance dict, and are built from the describe
+    responses so the responses themselves need not be kept.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return f'{self.kind.label} {self.identifier}'
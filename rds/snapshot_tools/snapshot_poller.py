@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+from .poll_schedule import AdaptivePollSchedule, DEFAULT_POLL_INTERVAL, MIN_POLL_INTERVAL
+from .snapshot_events import sleep_until_notified
+from .snapshot_kinds import DB_SNAPSHOT
+
+logger = logging.getLogger('my_app')
+
+# Number of snapshot identifiers sent in one describe filter
+DESCRIBE_BATCH_SIZE = 100
+# Statuses after which an encrypted copy will not change any more
+TERMINAL_SNAPSHOT_STATUSES = ('available', 'failed', 'incompatible-restore', 'incompatible-parameters')
+# Checks in a row a snapshot may be missing from the describe results before its waiters give up on it
+MAX_NOT_FOUND_CHECKS = 5
+# Status a waiter gets for a snapshot that stayed missing
+NOT_FOUND_STATUS = 'not-found'
+
+
+async def describe_snapshot_statuses(backend, snapshot_identifiers, kind=DB_SNAPSHOT):
+    # Fetch many snapshots of one kind with a few paginated calls instead of one call per snapshot
+    snapshots = {}
+    snapshot_identifiers = list(snapshot_identifiers)
+    for start in range(0, len(snapshot_identifiers), DESCRIBE_BATCH_SIZE):
+        batch = snapshot_identifiers[start:start + DESCRIBE_BATCH_SIZE]
+        async for page in backend.paginate('rds', kind.describe_operation, Filters=[{'Name': kind.filter_name, 'Values': batch}]):
+            for snapshot in page[kind.list_key]:
+                snapshots[snapshot[kind.identifier_key]] = snapshot
+    return snapshots
+
+
+async def describe_db_snapshot_statuses(backend, db_snapshot_identifiers):
+    return await describe_snapshot_statuses(backend, db_snapshot_identifiers, DB_SNAPSHOT)
+
+
+class SnapshotStatusPoller:
+    """Shared poller that checks every pending DB or cluster snapshot in batches.
+
+    Coroutines call ``wait_for_status`` and are woken with the latest status
+    of their snapshot each time it is checked. Each snapshot gets its own
+    next check time from an ``AdaptivePollSchedule``, and all snapshots that
+    are due are described together, so the API calls per tick grow with the
+    number of pages, not with the number of snapshots being waited on.
+
+    ``notify`` resolves or rechecks a snapshot right away, so with an RDS
+    event queue feeding it the schedule only has to catch lost events.
+    """
+
+    def __init__(self, backend, schedule=None, tick_interval=MIN_POLL_INTERVAL):
+        self.backend = backend
+        self.schedule = schedule or AdaptivePollSchedule()
+        self.tick_interval = tick_interval
+        self._pending = {}
+        self._next_check = {}
+        self._not_found = {}
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self, kind, snapshot_identifier, status=None):
+        # An event reported a change of this snapshot: a final status resolves its waiter, anything else checks it now
+        key = (kind, snapshot_identifier)
+        if status in TERMINAL_SNAPSHOT_STATUSES and key in self._pending:
+            future = self._pending.pop(key)
+            # The waiter may have been cancelled, e.g. with the copy that was waiting for it
+            if not future.done():
+                logger.debug("%s is in state %s (event)", snapshot_identifier, status)
+                future.set_result(status)
+        elif key in self._pending or key in self._next_check:
+            self._next_check[key] = 0
+            self._wake.set()
+
+    def next_status(self, snapshot_identifier, kind=DB_SNAPSHOT):
+        # Future resolved with the snapshot status at its next check (None if it was not found,
+        # NOT_FOUND_STATUS once it was missing MAX_NOT_FOUND_CHECKS times in a row)
+        key = (kind, snapshot_identifier)
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            if key not in self._next_check:
+                self._next_check[key] = time.time() + self.schedule.first_check_delay
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def wait_for_status(self, snapshot_identifier, target_statuses=TERMINAL_SNAPSHOT_STATUSES, kind=DB_SNAPSHOT):
+        # Returns the first status in target_statuses, or NOT_FOUND_STATUS if the snapshot stays missing
+        while True:
+            status = await self.next_status(snapshot_identifier, kind)
+            if status in target_statuses or status == NOT_FOUND_STATUS:
+                self._next_check.pop((kind, snapshot_identifier), None)
+                self._not_found.pop((kind, snapshot_identifier), None)
+                self.schedule.forget(snapshot_identifier, kind.identifier_key)
+                return status
+
+    async def _run(self):
+        try:
+            while self._pending:
+                now = time.time()
+                due = {}
+                for kind, identifier in self._pending:
+                    if self._next_check.get((kind, identifier), 0) <= now:
+                        due.setdefault(kind, []).append(identifier)
+                for kind, identifiers in due.items():
+                    await self._check(kind, identifiers)
+                # Woken waiters re-register during the sleep if they keep waiting
+                await sleep_until_notified(self._wake, self.tick_interval)
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self._fail_pending(None)
+            raise
+        except Exception as e:
+            # Hand the error to the waiters instead of leaving them on a task that is gone
+            logger.exception("ERROR: Snapshot status polling stopped")
+            self._fail_pending(e)
+        finally:
+            # The next waiter starts a new task
+            self._task = None
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if future.done():
+                continue
+            if error is None:
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    async def _check(self, kind, identifiers):
+        logger.debug("Checking status of %d of %d pending snapshots (%ss)", len(identifiers), len(self._pending), kind.label)
+        try:
+            snapshots = await describe_snapshot_statuses(self.backend, identifiers, kind)
+        except (ClientError, BotoCoreError) as e:
+            # Connection errors and timeouts included, the snapshots are checked again at the next tick
+            logger.info("ERROR: An unexpected error occurred while checking snapshot status: %s", e)
+            return
+        now = time.time()
+        for identifier in identifiers:
+            snapshot = snapshots.get(identifier)
+            if snapshot is None:
+                logger.info("ERROR: The specified %s %s could not be found for inspection.", kind.label, identifier)
+                misses = self._not_found[(kind, identifier)] = self._not_found.get((kind, identifier), 0) + 1
+                status = NOT_FOUND_STATUS if misses >= MAX_NOT_FOUND_CHECKS else None
+                delay = DEFAULT_POLL_INTERVAL
+            else:
+                self._not_found.pop((kind, identifier), None)
+                status = snapshot['Status']
+                delay = self.schedule.next_delay(snapshot, now)
+                logger.debug("%s is in state %s (%s%%), next check in %.0fs", identifier, status, snapshot.get('PercentProgress', 0), delay)
+            self._next_check[(kind, identifier)] = now + delay
+            # An event may have resolved the waiter during the describe call
+            future = self._pending.pop((kind, identifier), None)
+            if future is not None and not future.done():
+                future.set_result(status)
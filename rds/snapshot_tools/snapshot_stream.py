@@ -0,0 +1,38 @@
+from .snapshot_kinds import DB_SNAPSHOT
+
+# Snapshots requested per describe page
+PAGE_SIZE = 100
+
+
+async def stream_snapshots(backend, kind=DB_SNAPSHOT, **kwargs):
+    # Yield snapshots of one kind page by page, the next page is only fetched once this one is consumed
+    async for page in backend.paginate('rds', kind.describe_operation, PaginationConfig={'PageSize': PAGE_SIZE}, **kwargs):
+        for snapshot in page[kind.list_key]:
+            yield snapshot
+
+
+async def stream_snapshot_refs(backend, kind=DB_SNAPSHOT, where=None, **kwargs):
+    # Yield a SnapshotRef per snapshot (for which where holds); a page is turned into records before any is
+    # yielded, so the pipeline never holds a response page or snapshot dict past the next page fetch
+    async for page in backend.paginate('rds', kind.describe_operation, PaginationConfig={'PageSize': PAGE_SIZE}, **kwargs):
+        refs = [kind.ref(snapshot) for snapshot in page[kind.list_key] if where is None or where(snapshot)]
+        del page
+        for ref in refs:
+            yield ref
+
+
+async def stream_db_snapshots(backend, **kwargs):
+    async for snapshot in stream_snapshots(backend, DB_SNAPSHOT, **kwargs):
+        yield snapshot
+
+
+async def batched(source, size=PAGE_SIZE):
+    # Group the items of an async iterator into lists of up to size items
+    batch = []
+    async for item in source:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from .client_provider import RETRY_MAX_ATTEMPTS
+from .rate_limiter import api_family, get_bucket, record_response
+
+ENGINES = ('postgres', 'mysql', 'aurora-postgresql', 'mariadb', 'oracle-ee')
+
+
+def _client_error(code, operation_name, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+
+class StubBackend:
+    """In-memory stand-in for RDS, KMS and STS with the backend interface.
+
+    Every API attempt waits ``latency`` seconds and is throttled with
+    probability ``throttle_rate``, or when it exceeds ``service_rate``
+    requests per second for its API family; throttled attempts are retried
+    like botocore's standard retry mode. RDS and KMS attempts go through the
+    shared rate limiter like real clients. Encrypted copies go from
+    'creating' to 'available' over ``copy_duration`` seconds plus
+    ``copy_seconds_per_gib`` for each GiB of ``AllocatedStorage``, with a
+    growing ``PercentProgress``. ``calls`` and ``throttles`` count attempts
+    per operation and ``deletions`` records when each snapshot was deleted
+    and its allocated storage. With an ``events`` queue, such as a
+    ``LocalEventQueue``, every finished copy also publishes the RDS event
+    notification an event subscription would send. Copies with a
+    ``SourceRegion`` come from another region, which the stub makes up.
+    """
+
+    def __init__(self, snapshot_count, latency=0.005, page_size=100, throttle_rate=0.0,
+                 copy_duration=1.0, seed=0, service_rate=None, copy_seconds_per_gib=0.0, events=None,
+                 region_name='stub-region-1'):
+        self.region_name = region_name
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.copy_duration = copy_duration
+        self.copy_seconds_per_gib = copy_seconds_per_gib
+        self.service_rate = service_rate
+        self.events = events
+        self._service_tokens = {}
+        self.calls = Counter()
+        self.throttles = Counter()
+        self.deletions = []
+        self._random = random.Random(seed)
+        self._copy_started = {}
+        created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.snapshots = {}
+        for number in range(snapshot_count):
+            identifier = f'snapshot-{number:06d}'
+            self.snapshots[identifier] = {
+                'DBSnapshotIdentifier': identifier,
+                'DBInstanceIdentifier': f'instance-{number % 97:03d}',
+                'SnapshotType': 'manual',
+                'Status': 'available',
+                'Engine': ENGINES[number % len(ENGINES)],
+                'AllocatedStorage': self._random.choice((20, 100, 500, 2000, 8000)),
+                'SnapshotCreateTime': created + timedelta(minutes=number),
+                'PercentProgress': 100,
+                'Encrypted': False,
+            }
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def region(self):
+        return self.region_name
+
+    def _over_service_rate(self, family):
+        # Server side token bucket holding up to one second of requests
+        if self.service_rate is None:
+            return False
+        now = time.monotonic()
+        tokens, updated = self._service_tokens.get(family, (self.service_rate, now))
+        tokens = min(self.service_rate, tokens + (now - updated) * self.service_rate)
+        throttled = tokens < 1
+        self._service_tokens[family] = (tokens if throttled else tokens - 1, now)
+        return throttled
+
+    async def _attempt(self, service_name, operation_name):
+        family = api_family(service_name, operation_name)
+        bucket = get_bucket(f'stub/{self.region_name}', family) if service_name in ('rds', 'kms') else None
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            if bucket:
+                await bucket.acquire_async()
+            self.calls[operation_name] += 1
+            await asyncio.sleep(self.latency)
+            throttled = self._over_service_rate(family) or self._random.random() < self.throttle_rate
+            if bucket:
+                record_response(bucket, {'Error': {'Code': 'Throttling'}} if throttled else {})
+            if not throttled:
+                return
+            self.throttles[operation_name] += 1
+            await asyncio.sleep(self.latency * 2 ** attempt)
+        raise _client_error('Throttling', operation_name, 'Rate exceeded')
+
+    def _current(self, snapshot):
+        # Advance an encrypted copy according to the time since it was started
+        copy = self._copy_started.get(snapshot.get('DBSnapshotIdentifier'))
+        if copy is not None and snapshot['Status'] == 'creating':
+            started, duration = copy
+            progress = min(100, int((time.monotonic() - started) / duration * 100))
+            snapshot['PercentProgress'] = progress
+            if progress >= 100:
+                snapshot['Status'] = 'available'
+                del self._copy_started[snapshot['DBSnapshotIdentifier']]
+        return dict(snapshot)
+
+    async def call(self, service_name, operation_name, **kwargs):
+        await self._attempt(service_name, operation_name)
+        return getattr(self, f'_{operation_name}')(**kwargs)
+
+    async def paginate(self, service_name, operation_name, PaginationConfig=None, **kwargs):
+        page_size = min(self.page_size, (PaginationConfig or {}).get('PageSize', self.page_size))
+        result_key, items = getattr(self, f'_{operation_name}_items')(**kwargs)
+        for start in range(0, max(len(items), 1), page_size):
+            await self._attempt(service_name, operation_name)
+            yield {result_key: [self._current(item) for item in items[start:start + page_size]]}
+
+    def _describe_db_snapshots_items(self, SnapshotType=None, Filters=None):
+        if Filters:
+            identifiers = [value for snapshot_filter in Filters for value in snapshot_filter['Values']]
+            matches = [self.snapshots[identifier] for identifier in identifiers if identifier in self.snapshots]
+        else:
+            matches = list(self.snapshots.values())
+        if SnapshotType:
+            matches = [snapshot for snapshot in matches if snapshot['SnapshotType'] == SnapshotType]
+        return 'DBSnapshots', matches
+
+    def _describe_db_cluster_snapshots_items(self, SnapshotType=None, Filters=None):
+        # The stub only holds DB instance snapshots
+        return 'DBClusterSnapshots', []
+
+    def _describe_events_items(self, **kwargs):
+        return 'Events', []
+
+    def _describe_db_snapshots(self, DBSnapshotIdentifier):
+        if DBSnapshotIdentifier not in self.snapshots:
+            raise _client_error('DBSnapshotNotFound', 'DescribeDBSnapshots')
+        return {'DBSnapshots': [self._current(self.snapshots[DBSnapshotIdentifier])]}
+
+    def _copy_db_snapshot(self, SourceDBSnapshotIdentifier, TargetDBSnapshotIdentifier, KmsKeyId, SourceRegion=None, **kwargs):
+        source = self.snapshots.get(SourceDBSnapshotIdentifier)
+        if source is None and SourceRegion is not None:
+            # Cross-region copy from an ARN: the stub only holds its own region, so stand in for the source
+            source = dict(next(iter(self.snapshots.values()), {}), AllocatedStorage=100, Encrypted=True)
+        if source is None:
+            raise _client_error('DBSnapshotNotFound', 'CopyDBSnapshot')
+        if TargetDBSnapshotIdentifier in self.snapshots:
+            raise _client_error('DBSnapshotAlreadyExists', 'CopyDBSnapshot')
+        target = dict(source,
+                      DBSnapshotIdentifier=TargetDBSnapshotIdentifier, Status='creating',
+                      PercentProgress=0, Encrypted=True, KmsKeyId=KmsKeyId,
+                      SnapshotCreateTime=datetime.now(timezone.utc))
+        self.snapshots[TargetDBSnapshotIdentifier] = target
+        duration = self.copy_duration + self.copy_seconds_per_gib * target['AllocatedStorage']
+        self._copy_started[TargetDBSnapshotIdentifier] = (time.monotonic(), duration)
+        if self.events is not None:
+            asyncio.get_running_loop().call_later(duration, self._publish_copy_finished, TargetDBSnapshotIdentifier)
+        return {'DBSnapshot': dict(target)}
+
+    def _publish_copy_finished(self, identifier):
+        snapshot = self.snapshots.get(identifier)
+        if snapshot is None or identifier not in self._copy_started:
+            return
+        del self._copy_started[identifier]
+        snapshot.update(Status='available', PercentProgress=100)
+        self.events.put(json.dumps({
+            'Event Source': 'db-snapshot',
+            'Event Time': datetime.now(timezone.utc).isoformat(),
+            'Source ID': identifier,
+            'Event ID': 'RDS-EVENT-0197',
+            'Event Message': f'Finished copy of snapshot {identifier}',
+        }))
+
+    def _delete_db_snapshot(self, DBSnapshotIdentifier):
+        snapshot = self.snapshots.pop(DBSnapshotIdentifier, None)
+        if snapshot is None:
+            raise _client_error('DBSnapshotNotFound', 'DeleteDBSnapshot')
+        self.deletions.append((time.monotonic(), snapshot['AllocatedStorage']))
+        return {'DBSnapshot': dict(snapshot, Status='deleted')}
+
+    def _describe_account_attributes(self):
+        return {'AccountQuotas': [{'AccountQuotaName': 'ManualSnapshots', 'Used': len(self.snapshots), 'Max': 10 ** 9}]}
+
+    def _describe_key(self, KeyId):
+        return {'KeyMetadata': {'KeyId': 'stub-key'}}
+
+    def _get_caller_identity(self):
+        return {'Account': '000000000000'}